@@ -0,0 +1,84 @@
+"""Generate one changelog against a fixture, reporting timings as JSON.
+
+This is run by benchmarks.run in a fresh process for every measurement, so
+that no in-memory state carries over between runs::
+
+    python -m benchmarks.driver SETTINGS
+
+where SETTINGS is a JSON object holding ``config`` (overrides for
+rubin_changelog.config), ``pattern``, ``output_dir``, ``jobs`` and
+``no_store``.
+"""
+
+import json
+import logging
+import sys
+import time
+
+from typing import Any, Dict
+
+
+def main(settings: Dict[str, Any]) -> Dict[str, Any]:
+    # Configuration is read when modules are imported, so it must be
+    # overridden before importing anything else.
+    import rubin_changelog.config as config
+
+    for name, value in settings["config"].items():
+        setattr(config, name, value)
+
+    phases: Dict[str, float] = {}
+    start = time.monotonic()
+    from rubin_changelog.changelog_store import ChangelogStore
+    from rubin_changelog.eups import Eups
+    from rubin_changelog.jira import JiraCache
+    from rubin_changelog.output import write_changelog
+    from rubin_changelog.products import products
+    from rubin_changelog.profile import PROFILE
+    from rubin_changelog.range_cache import RangeCache
+    from rubin_changelog.scheduler import Scheduler
+
+    import git_changelog
+
+    phases["import"] = time.monotonic() - start
+
+    scheduler = Scheduler({"network": settings["jobs"], "git": config.GIT_WORKERS})
+    store = (
+        None
+        if settings["no_store"]
+        else ChangelogStore.for_pattern(settings["pattern"])
+    )
+    with JiraCache() as jira, RangeCache() as range_cache:
+        mark = time.monotonic()
+        eups = Eups(pattern=settings["pattern"], scheduler=scheduler)
+        phases["manifests"] = time.monotonic() - mark
+
+        mark = time.monotonic()
+        changelog = git_changelog.generate_changelog(
+            eups, store, scheduler=scheduler, jira=jira, range_cache=range_cache
+        )
+        scheduler.shutdown()
+        phases["changelog"] = time.monotonic() - mark
+
+        mark = time.monotonic()
+        write_changelog(changelog, eups.all_products, settings["output_dir"], jira=jira)
+        phases["output"] = time.monotonic() - mark
+    products.save()
+
+    return {
+        "total": time.monotonic() - start,
+        "phases": phases,
+        "stages": {
+            stage: {"count": timing.count, "wall": timing.wall, "busy": timing.busy}
+            for stage, timing in scheduler.timings().items()
+        },
+        "tags": len(changelog),
+        "tickets": sum(len(entry.tickets) for entry in changelog.values()),
+        "repositories": dict(products.fetch_counts),
+        "profile": PROFILE.report(scheduler.timings()),
+    }
+
+
+if __name__ == "__main__":
+    # Some fixture products are deliberately tagged by date, which warns.
+    logging.basicConfig(level=logging.ERROR)
+    print(json.dumps(main(json.loads(sys.argv[1]))))
@@ -0,0 +1,185 @@
+"""Synthetic stand-ins for the repositories, EUPS tags and repos.yaml."""
+
+import json
+import os
+import shutil
+import subprocess
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+# First synthetic weekly; later ones follow at weekly intervals.
+FIRST_TAG_DATE = datetime(2021, 1, 8, tzinfo=timezone.utc)
+
+# Products whose number modulo this is zero publish versions with no
+# corresponding git tag, so they are tagged by date.
+UNTAGGED_EVERY = 5
+
+# Tickets numbered from here.
+FIRST_TICKET = 1000
+
+
+def tag_name(tag_number: int) -> str:
+    year, week, _ = (FIRST_TAG_DATE + timedelta(weeks=tag_number)).isocalendar()
+    return f"w_{year}_{week:02d}"
+
+
+def tag_date(tag_number: int) -> datetime:
+    return FIRST_TAG_DATE + timedelta(weeks=tag_number)
+
+
+def product_name(product_number: int) -> str:
+    return f"product{product_number:04d}"
+
+
+def changes(product_number: int, tag_number: int) -> bool:
+    """True if product_number has a new version in tag_number.
+
+    Most, but not all, products change in any given weekly.
+    """
+    return tag_number == 0 or (product_number + tag_number) % 3 != 0
+
+
+def ticket(product_number: int, tag_number: int, merge_number: int, merges: int) -> str:
+    """The ticket merged. Even-numbered merges in a tag share a ticket across
+    every product, like a stack-wide change; the rest are per-product.
+    """
+    number = FIRST_TICKET + tag_number * merges + merge_number
+    if merge_number % 2:
+        number += (product_number + 1) * 1000000
+    return f"DM-{number}"
+
+
+def _fast_import_stream(product_number: int, tags: int, merges: int) -> str:
+    """A git fast-import stream for the history of product_number.
+
+    Each version on the branch is preceded by merges ticket branches, each
+    with one commit touching a file.
+    """
+    lines: List[str] = []
+    mark = 0
+
+    def commit(ref: str, when: datetime, message: str, parents: List[int]) -> int:
+        nonlocal mark
+        mark += 1
+        data = message.encode("utf-8")
+        lines.append(f"commit {ref}")
+        lines.append(f"mark :{mark}")
+        lines.append(f"committer Bench <bench@example.com> {int(when.timestamp())} +0000")
+        lines.append(f"data {len(data)}")
+        lines.append(message)
+        if parents:
+            lines.append(f"from :{parents[0]}")
+        for parent in parents[1:]:
+            lines.append(f"merge :{parent}")
+        content = f"{message}\n"
+        lines.append("M 644 inline CHANGES")
+        lines.append(f"data {len(content.encode('utf-8'))}")
+        lines.append(content)
+        return mark
+
+    start = tag_date(0) - timedelta(days=7)
+    # Keep each version's merges within the week before it is tagged.
+    step = timedelta(days=5) / (2 * max(merges, 1))
+    mainline = commit("refs/heads/master", start, "Initial commit", [])
+    version = 0
+    for tag_number in range(tags):
+        if not changes(product_number, tag_number):
+            continue
+        when = tag_date(tag_number) - timedelta(days=6)
+        for merge_number in range(merges):
+            ticket_id = ticket(product_number, tag_number, merge_number, merges)
+            when += step
+            work = commit(
+                "refs/heads/work", when, f"{ticket_id}: work on {ticket_id}", [mainline]
+            )
+            when += step
+            mainline = commit(
+                "refs/heads/master",
+                when,
+                f"Merge pull request #{mark} from lsst/tickets/{ticket_id}\n\n"
+                f"{ticket_id}: work on {ticket_id}",
+                [mainline, work],
+            )
+        version += 1
+        if product_number % UNTAGGED_EVERY:
+            data = f"Version {version}".encode("utf-8")
+            lines.append(f"tag {version}.0")
+            lines.append(f"from :{mainline}")
+            lines.append(
+                f"tagger Bench <bench@example.com> {int(when.timestamp())} +0000"
+            )
+            lines.append(f"data {len(data)}")
+            lines.append(data.decode("utf-8"))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _manifests(products: int, tags: int) -> Dict[str, str]:
+    manifests = {}
+    versions = [0] * products
+    for tag_number in range(tags):
+        lines = [
+            f"EUPS distribution {tag_name(tag_number)} version list. Version 1.0",
+            "#name flavor version",
+        ]
+        for product_number in range(products):
+            if changes(product_number, tag_number):
+                versions[product_number] += 1
+            version = f"{versions[product_number]}.0"
+            if product_number % UNTAGGED_EVERY == 0:
+                version += f"-g{versions[product_number]:07x}"
+            lines.append(f"{product_name(product_number)} generic {version}+1")
+        manifests[tag_name(tag_number)] = "\n".join(lines) + "\n"
+    return manifests
+
+
+def build_fixture(root: str, *, products: int, tags: int, merges: int) -> str:
+    """Create bare repositories and EUPS manifests for products products
+    across tags weekly tags with merges merges per product version, under
+    root, which is clobbered. Returns root.
+
+    Repositories are written to ``root/remote``; ``root/srv`` contains
+    ``repos.yaml``, with a placeholder for the repository location, and the
+    tag manifests.
+    """
+    shutil.rmtree(root, ignore_errors=True)
+    tags_dir = os.path.join(root, "srv", "tags")
+    os.makedirs(tags_dir)
+    for product_number in range(products):
+        path = os.path.join(root, "remote", f"{product_name(product_number)}.git")
+        subprocess.run(["git", "init", "--quiet", "--bare", path], check=True)
+        subprocess.run(
+            ["git", "symbolic-ref", "HEAD", "refs/heads/master"], cwd=path, check=True
+        )
+        # Permit partial clones of local repositories.
+        subprocess.run(
+            ["git", "config", "uploadpack.allowFilter", "true"], cwd=path, check=True
+        )
+        subprocess.run(
+            ["git", "fast-import", "--quiet"],
+            cwd=path,
+            input=_fast_import_stream(product_number, tags, merges).encode("utf-8"),
+            check=True,
+        )
+        subprocess.run(
+            ["git", "update-ref", "-d", "refs/heads/work"], cwd=path, check=True
+        )
+
+    with open(os.path.join(root, "srv", "repos.yaml"), "w") as f:
+        for product_number in range(products):
+            name = product_name(product_number)
+            path = os.path.abspath(os.path.join(root, "remote", f"{name}.git"))
+            f.write(f"{name}: file://{path}\n")
+
+    dates = {}
+    for name, manifest in _manifests(products, tags).items():
+        with open(os.path.join(tags_dir, f"{name}.list"), "w") as f:
+            f.write(manifest)
+    for tag_number in range(tags):
+        dates[tag_name(tag_number)] = int(tag_date(tag_number).timestamp())
+    with open(os.path.join(root, "srv", "dates.json"), "w") as f:
+        json.dump(dates, f)
+    with open(os.path.join(root, "scale.json"), "w") as f:
+        json.dump({"products": products, "tags": tags, "merges": merges}, f)
+    return root
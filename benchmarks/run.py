@@ -0,0 +1,144 @@
+"""Benchmark changelog generation against synthetic, local stand-ins for
+the product repositories, the EUPS distribution server, repos.yaml and Jira.
+
+    python -m benchmarks.run --scale 20x20x5 --scale 100x50x10
+
+A scale is products x weekly tags x merges per product version. The fixture
+for each scale is built once under --workdir and re-used. Each scale is run
+cold (no repositories or caches), then warm --repeat times, every run in a
+fresh process. The total time, the time spent in each phase and pipeline
+stage, and the requests made of the server are reported, and written as JSON
+to --output if given.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from typing import Any, Dict, List, Tuple
+
+from .fixture import build_fixture
+from .server import FixtureServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_scale(scale: str) -> Tuple[int, int, int]:
+    try:
+        products, tags, merges = (int(n) for n in scale.split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected PRODUCTSxTAGSxMERGES, not {scale}")
+    return products, tags, merges
+
+
+def fixture_for(workdir: str, products: int, tags: int, merges: int) -> str:
+    path = os.path.join(workdir, f"fixture-{products}x{tags}x{merges}")
+    scale = {"products": products, "tags": tags, "merges": merges}
+    try:
+        with open(os.path.join(path, "scale.json")) as f:
+            if json.load(f) == scale:
+                return path
+    except (OSError, ValueError):
+        pass
+    print(f"Building fixture {products}x{tags}x{merges}", file=sys.stderr)
+    return build_fixture(path, products=products, tags=tags, merges=merges)
+
+
+def run_once(
+    server: FixtureServer, state_dir: str, args: argparse.Namespace
+) -> Dict[str, Any]:
+    """Generate the changelog for the fixture served by server in a new
+    process, keeping repositories and caches in state_dir.
+    """
+    config = {
+        "TARGET_DIR": os.path.join(state_dir, "repos"),
+        "TICKET_CACHE": os.path.join(state_dir, "repos", "ticket.cache"),
+        "RANGE_CACHE": os.path.join(state_dir, "repos", "range.cache"),
+        "REMOTE_HEADS": os.path.join(state_dir, "repos", "remote-heads.json"),
+        "EUPS_MANIFEST_CACHE": os.path.join(state_dir, "repos", "manifests"),
+        "CHANGELOG_STORE_DIR": os.path.join(state_dir, "repos", "changelog"),
+        **server.config,
+    }
+    settings = {
+        "config": config,
+        "pattern": r"w_20",
+        "output_dir": os.path.join(state_dir, "output"),
+        "jobs": args.jobs,
+        "no_store": args.no_store,
+    }
+    server.requests.clear()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.driver", json.dumps(settings)],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    result = json.loads(output)
+    result["requests"] = dict(server.requests)
+    return result
+
+
+def format_result(label: str, result: Dict[str, Any]) -> str:
+    phases = "  ".join(f"{k} {v:.2f}s" for k, v in result["phases"].items())
+    stages = "  ".join(f"{k} {v['wall']:.2f}s" for k, v in result["stages"].items())
+    requests = ", ".join(f"{v} {k}" for k, v in sorted(result["requests"].items()))
+    return (
+        f"{label:<24} total {result['total']:.2f}s\n"
+        f"{'':<24} phases: {phases}\n"
+        f"{'':<24} stages: {stages}\n"
+        f"{'':<24} requests: {requests or 'none'}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scale",
+        type=parse_scale,
+        action="append",
+        metavar="PRODUCTSxTAGSxMERGES",
+        help="May be repeated (default: 20x20x5)",
+    )
+    parser.add_argument("--repeat", type=int, default=2, help="Warm runs per scale")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Delay every HTTP response by this long",
+    )
+    parser.add_argument("--jobs", type=int, default=8, help="Network workers")
+    parser.add_argument("--no-store", action="store_true")
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "changelog-benchmarks"),
+        help="Where fixtures, repositories and caches are kept",
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for products, tags, merges in args.scale or [(20, 20, 5)]:
+        fixture = fixture_for(args.workdir, products, tags, merges)
+        state_dir = os.path.join(fixture, "state")
+        shutil.rmtree(state_dir, ignore_errors=True)
+        with FixtureServer(fixture, latency=args.latency) as server:
+            for run in ["cold"] + [f"warm {n + 1}" for n in range(args.repeat)]:
+                result = run_once(server, state_dir, args)
+                result.update(
+                    {"products": products, "tags": tags, "merges": merges, "run": run}
+                )
+                results.append(result)
+                print(format_result(f"{products}x{tags}x{merges} {run}", result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
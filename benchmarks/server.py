@@ -0,0 +1,148 @@
+"""A local HTTP server standing in for the EUPS distribution server,
+repos.yaml and the Jira REST API.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import typing
+
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+class FixtureServer(object):
+    """Serve the fixture under root (see build_fixture) on localhost.
+
+    Every response is delayed by latency seconds, to mimic a remote server.
+    Requests are counted by endpoint in ``requests``.
+    """
+
+    def __init__(self, root: str, *, latency: float = 0.0):
+        self.root = root
+        self.latency = latency
+        self.requests: typing.Counter[str] = Counter()
+        self._lock = threading.Lock()
+        with open(os.path.join(root, "srv", "dates.json")) as f:
+            self._dates: Dict[str, int] = json.load(f)
+        handler = type("Handler", (_Handler,), {"fixture": self})
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    @property
+    def config(self) -> Dict[str, str]:
+        """Overrides for rubin_changelog.config pointing at this server."""
+        return {
+            "EUPS_PKGROOT": f"{self.url}/stack/src/",
+            "REPOS_YAML": f"{self.url}/repos.yaml",
+            "JIRA_API_URL": f"{self.url}/jira",
+        }
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def tag_date(self, tag_name: str) -> Optional[int]:
+        return self._dates.get(tag_name)
+
+    def __enter__(self) -> "FixtureServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fixture: FixtureServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        time.sleep(self.fixture.latency)
+        url = urlsplit(self.path)
+        path = re.sub(r"/+", "/", url.path)
+        tags_dir = os.path.join(self.fixture.root, "srv", "tags")
+        if path == "/repos.yaml":
+            self.fixture.count("repos.yaml")
+            with open(os.path.join(self.fixture.root, "srv", "repos.yaml"), "rb") as f:
+                self.send(200, f.read(), "text/plain")
+        elif path.rstrip("/") == "/stack/src/tags":
+            self.fixture.count("tag list")
+            rows = "".join(
+                f'<tr><td><a href="{name}">{name}</a></td></tr>'
+                for name in sorted(os.listdir(tags_dir))
+            )
+            body = f"<html><body><table>{rows}</table></body></html>"
+            self.send(200, body.encode("utf-8"), "text/html")
+        elif path.startswith("/stack/src/tags/") and path.endswith(".list"):
+            self.fixture.count("manifest")
+            self.send_manifest(tags_dir, os.path.basename(path))
+        elif path.startswith("/jira/issue/"):
+            self.fixture.count("jira issue")
+            ticket = path.split("/")[-1]
+            self.send_json({"key": ticket, "fields": {"summary": f"Summary of {ticket}"}})
+        elif path == "/jira/search":
+            self.fixture.count("jira search")
+            jql = parse_qs(url.query).get("jql", [""])[0]
+            self.send_json(
+                {
+                    "issues": [
+                        {"key": ticket, "fields": {"summary": f"Summary of {ticket}"}}
+                        for ticket in re.findall(r"DM-\d+", jql, re.IGNORECASE)
+                    ]
+                }
+            )
+        else:
+            self.fixture.count("not found")
+            self.send(404, b"", "text/plain")
+
+    def send_manifest(self, tags_dir: str, filename: str) -> None:
+        timestamp = self.fixture.tag_date(filename[: -len(".list")])
+        path = os.path.join(tags_dir, filename)
+        if timestamp is None or not os.path.exists(path):
+            self.send(404, b"", "text/plain")
+            return
+        since = self.headers.get("If-Modified-Since")
+        if since and parsedate_to_datetime(since).timestamp() >= timestamp:
+            self.send(304, b"", "text/plain")
+            return
+        with open(path, "rb") as f:
+            self.send(
+                200,
+                f.read(),
+                "text/plain",
+                {"Last-Modified": formatdate(timestamp, usegmt=True)},
+            )
+
+    def send_json(self, content) -> None:
+        self.send(200, json.dumps(content).encode("utf-8"), "application/json")
+
+    def send(
+        self,
+        status: int,
+        body: bytes,
+        content_type: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
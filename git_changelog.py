@@ -1,80 +1,470 @@
 import argparse
+import json
 import logging
+import sqlite3
+import sys
+import time
 
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Set
+from subprocess import CalledProcessError
+from typing import Dict, List, Mapping, Optional, Set, Tuple
 
-from rubin_changelog.eups import Eups, EupsTag
-from rubin_changelog.output import print_changelog
+from rubin_changelog.changelog_store import ChangelogStore
+from rubin_changelog.config import GIT_WORKERS, NETWORK_WORKERS, TICKET_INDEX
+from rubin_changelog.eups import Eups, EupsTag, TagSelectionError
+from rubin_changelog.ids import PRODUCTS
+from rubin_changelog.jira import JiraCache
+from rubin_changelog.output import print_changelog, write_changelog
 from rubin_changelog.products import products
-from rubin_changelog.typing import Changelog
+from rubin_changelog.profile import PROFILE
+from rubin_changelog.range_cache import RangeCache
+from rubin_changelog.scheduler import Scheduler
+from rubin_changelog.ticket_index import Release, TicketIndex
+from rubin_changelog.typing import Changelog, ChangelogEntry
 
 
 def get_merges_for_product(
-    product_name: str, old_tag_name: str, new_tag_name: str
-) -> Set[str]:
-    merged = set()
-    try:
-        product = products[product_name]
-    except KeyError:
-        logging.debug(f"Skipping ticket list on {product_name} (probably skiplisted)")
+    product_name: str,
+    old_tag_name: str,
+    new_tag_name: str,
+    range_cache: Optional[RangeCache] = None,
+) -> Optional[Set[str]]:
+    """Tickets merged to product_name between old_tag_name and new_tag_name,
+    or None if they couldn't be determined.
+    """
+    merged: Optional[Set[str]] = None
+    with PROFILE.timed(diff_tag=new_tag_name, diff_product=product_name):
+        try:
+            product = products[product_name]
+        except KeyError as e:
+            if products.has_failed(product_name):
+                logging.warning(f"Unable to list merges for {product_name}: {e}")
+            else:
+                logging.debug(f"Skipping ticket list on {product_name} (probably skiplisted)")
+                merged = set()
+        else:
+            old_ref_name = f"refs/tags/{old_tag_name}"
+            new_ref_name = (
+                f"refs/tags/{new_tag_name}"
+                if new_tag_name != "master"
+                else product.branch_name
+            )
+            try:
+                old_sha, new_sha = product.resolve(old_ref_name, new_ref_name)
+                if range_cache is not None:
+                    cached = range_cache.get(product_name, old_sha, new_sha)
+                    if cached is not None:
+                        return cached
+                merged = product.merge_tickets(old_sha, new_sha)
+            except CalledProcessError as e:
+                logging.warning(
+                    f"Unable to list merges for {product_name} between "
+                    f"{old_tag_name} and {new_tag_name}: {e.output}"
+                )
+            except KeyError as e:
+                logging.warning(f"Unable to list merges for {product_name}: {e}")
+            else:
+                if range_cache is not None:
+                    range_cache.put(product_name, old_sha, new_sha, merged)
+    return merged
+
+
+def diff_tags(
+    new_tag: EupsTag,
+    old_tag: EupsTag,
+    range_cache: RangeCache,
+    scheduler: Scheduler,
+    tagging: Mapping[str, Future],
+    stored: Optional[ChangelogEntry] = None,
+) -> Tuple[ChangelogEntry, Dict[str, Future]]:
+    """Return an entry recording the products added and dropped between
+    old_tag and new_tag, and a future for the tickets merged to each product
+    in common.
+
+    If stored is an entry recorded on a previous run, it is returned instead,
+    and only the products which couldn't be diffed then are retried. Each
+    product is diffed as soon as it has been tagged.
+    """
+    if stored is None:
+        entry = ChangelogEntry(
+            added_bits=new_tag.product_bits & ~old_tag.product_bits,
+            dropped_bits=old_tag.product_bits & ~new_tag.product_bits,
+        )
+        product_bits = new_tag.product_bits & old_tag.product_bits
     else:
-        old_ref_name = f"refs/tags/{old_tag_name}"
-        new_ref_name = (
-            f"refs/tags/{new_tag_name}"
-            if new_tag_name != "master"
-            else product.branch_name
+        entry, product_bits = stored, stored.failed_bits
+        entry.failed_bits = 0
+    futures = {
+        product_name: scheduler.submit(
+            "git",
+            get_merges_for_product,
+            product_name,
+            old_tag.name,
+            new_tag.name,
+            range_cache,
+            after=[tagging[product_name]] if product_name in tagging else [],
+            stage="diff",
         )
-        merges = product.merges_between(old_ref_name, new_ref_name)
-        for sha in merges:
-            ticket = product.ticket(product.message(sha))
-            if ticket:
-                merged.add(ticket)
-    return merged
+        for product_name in PRODUCTS.names(product_bits)
+        # Products with identical versions can't have any new merges.
+        if new_tag.name == "master"
+        or new_tag.versions[product_name] != old_tag.versions[product_name]
+    }
+    return entry, futures
+
 
+def generate_changelog(
+    eups: Eups,
+    store: Optional[ChangelogStore] = None,
+    *,
+    scheduler: Optional[Scheduler] = None,
+    jira: Optional[JiraCache] = None,
+    range_cache: Optional[RangeCache] = None,
+) -> Changelog:
+    """Diff every adjacent pair of tags in eups.
 
-def generate_changelog(eups: Eups) -> Changelog:
+    All pairs are scheduled at once, so that work on different tags and
+    products overlaps. If jira is supplied, the tickets merged between each
+    pair are prefetched, using the scheduler's network workers, once they are
+    known; failure to prefetch is not fatal. A range_cache must be supplied
+    if several changelogs are generated concurrently. Entries computed so far
+    are saved to store even if the run fails.
+    """
+    own_scheduler = scheduler is None
+    if scheduler is None:
+        scheduler = Scheduler()
     tags = sorted(eups.values(), reverse=True)
     tags.insert(
         0,
         EupsTag("master", datetime(1, 1, 1), [(p, "dummy") for p in tags[0].products]),
     )
     changelog: Changelog = {}
-    for new_tag, old_tag in zip(tags, tags[1:]):
-        added = set(new_tag.products) - set(old_tag.products)
-        dropped = set(old_tag.products) - set(new_tag.products)
-        tickets = defaultdict(set)
+    with ExitStack() as stack:
+        # Unwound in reverse: tasks finish before the range cache is closed,
+        # and the entries computed so far are saved even if the run fails.
+        if store is not None:
+            stack.callback(store.save)
+        if range_cache is None:
+            range_cache = stack.enter_context(RangeCache())
+        if own_scheduler:
+            stack.callback(scheduler.shutdown)
+        pending = {}
+        for new_tag, old_tag in zip(tags, tags[1:]):
+            # The master pseudo-tag moves, so it is always recomputed.
+            entry = (
+                store.get(new_tag.name, old_tag.name)
+                if store is not None and new_tag.name != "master"
+                else None
+            )
+            if entry is not None and entry.complete:
+                changelog[new_tag] = entry
+                continue
+            if entry is None:
+                logging.info(f"Computing changes from {old_tag.name} to {new_tag.name}")
+            else:
+                logging.info(
+                    f"Retrying {', '.join(sorted(entry.failed))} "
+                    f"from {old_tag.name} to {new_tag.name}"
+                )
+            pending[new_tag] = old_tag, *diff_tags(
+                new_tag, old_tag, range_cache, scheduler, eups.tagging, entry
+            )
+
+        requested: Set[str] = set()  # tickets already being prefetched.
+        prefetching: List[Future] = []
+        for new_tag, (old_tag, entry, futures) in pending.items():
+            for product_name, future in futures.items():
+                tickets = future.result()
+                if tickets is None:
+                    entry.add_failure(product_name)
+                else:
+                    entry.add_tickets(product_name, tickets)
+            if jira is not None:
+                prefetching.extend(
+                    scheduler.submit("network", jira.fetch_batch, batch, stage="jira")
+                    for batch in jira.batches(set(entry.tickets) - requested)
+                )
+                requested.update(entry.tickets)
+            changelog[new_tag] = entry
+            # Products which failed are retried next time.
+            if store is not None and new_tag.name != "master":
+                store.put(new_tag.name, old_tag.name, entry)
+
+        for future in prefetching:
+            # Summaries only decorate the output, so carry on without them.
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning(f"Failed to prefetch tickets: {e!r}")
+    # Present tags newest first, irrespective of where they came from.
+    return {tag: changelog[tag] for tag in tags[:-1]}
+
+VIEW_PREFIXES = {"weekly": r"w_20", "release": r"v\d\d"}
 
-        with ThreadPoolExecutor() as executor:
-            future_to_merges = {
+
+def generate_view(
+    tag_prefix: str,
+    output_dir: Optional[str],
+    args: argparse.Namespace,
+    scheduler: Scheduler,
+    jira: JiraCache,
+    range_cache: RangeCache,
+    ticket_index: Optional[TicketIndex] = None,
+) -> None:
+    """Generate and write the changelog for tags matching tag_prefix, to
+    output_dir or, if that is None, to standard output, recording the
+    tickets shipped in ticket_index if supplied.
+    """
+    store = None if args.no_store else ChangelogStore.for_pattern(tag_prefix)
+    eups = Eups(
+        pattern=tag_prefix, scheduler=scheduler, since=args.since, last=args.last
+    )
+    changelog = generate_changelog(
+        eups, store, scheduler=scheduler, jira=jira, range_cache=range_cache
+    )
+    if ticket_index is not None:
+        ticket_index.update(changelog)
+    if output_dir:
+        written = write_changelog(changelog, eups.all_products, output_dir, jira=jira)
+        logging.info(f"Wrote {', '.join(written) or 'nothing'} to {output_dir}")
+    else:
+        print_changelog(changelog, eups.all_products, jira=jira)
+
+
+def run_views(
+    views: List[Tuple[str, Optional[str]]], args: argparse.Namespace, jira: JiraCache
+) -> None:
+    """Generate every view, sharing a scheduler, range cache and ticket
+    index.
+    """
+    workers = {"network": args.jobs, "git": GIT_WORKERS}
+    with Scheduler(workers) as scheduler, TicketIndex() as ticket_index:
+        # Each view blocks waiting for its own results, so run them side by
+        # side to let their work overlap.
+        with RangeCache() as range_cache, ThreadPoolExecutor(
+            max_workers=len(views)
+        ) as executor:
+            for future in [
                 executor.submit(
-                    get_merges_for_product, product_name, old_tag.name, new_tag.name
-                ): product_name
-                for product_name in set(new_tag.products) & set(old_tag.products)
-            }
-            for future in as_completed(future_to_merges):
-                product_name = future_to_merges[future]
-                for merge in future.result():
-                    tickets[merge].add(product_name)
-
-        changelog[new_tag] = {"added": added, "dropped": dropped, "tickets": tickets}
-    return changelog
+                    generate_view,
+                    tag_prefix,
+                    output_dir,
+                    args,
+                    scheduler,
+                    jira,
+                    range_cache,
+                    ticket_index,
+                )
+                for tag_prefix, output_dir in views
+            ]:
+                future.result()
+    products.save()
+    products.log_fetch_counts()
+    if args.profile:
+        PROFILE.write(args.profile, scheduler.timings())
+        logging.info(f"Wrote profile to {args.profile}")
+
+
+def watch(
+    views: List[Tuple[str, Optional[str]]], args: argparse.Namespace, jira: JiraCache
+) -> None:
+    """Regenerate views every args.watch seconds, but only if a tag has been
+    published, or the branch or tags of a product have changed on origin,
+    since the last time.
+
+    Repositories and their tags are kept in memory between polls, so only the
+    tag listing, repos.yaml and the state of each origin are checked on each
+    one. Products which failed to clone or fetch are retried on every poll.
+    """
+    seen: Optional[List[List[str]]] = None
+    # Products fetched but not yet reflected in the output.
+    updated: Set[str] = set()
+    while True:
+        try:
+            tag_names = [
+                sorted(Eups.tag_names(pattern=tag_prefix)) for tag_prefix, _ in views
+            ]
+            updated.update(products.reload(max_workers=args.jobs))
+            updated.update(products.refresh(max_workers=args.jobs))
+            if tag_names != seen or updated:
+                if seen is not None:
+                    logging.info(
+                        f"Regenerating; new tags: {tag_names != seen}, "
+                        f"products updated: {', '.join(sorted(updated)) or 'none'}"
+                    )
+                    PROFILE.reset()
+                run_views(views, args, jira)
+                seen = tag_names
+                updated.clear()
+            else:
+                logging.debug("Nothing changed")
+        except Exception:
+            logging.exception("Failed to regenerate changelog; will retry")
+        time.sleep(args.watch)
+
+
+def ticket_key(ticket: str) -> Tuple[str, int]:
+    project, _, number = ticket.partition("-")
+    return project, int(number) if number.isdigit() else 0
+
+
+def lookup(args: argparse.Namespace) -> int:
+    """Answer the queries in args from the ticket index, returning the exit
+    status.
+    """
+    try:
+        ticket_index = TicketIndex(args.index, readonly=True)
+    except sqlite3.OperationalError as e:
+        logging.error(f"Unable to open ticket index {args.index}: {e}")
+        return 1
+    with ticket_index:
+        results: Dict[str, List[Release]] = {
+            ticket.upper(): ticket_index.ticket(ticket) for ticket in args.tickets
+        }
+        if args.product:
+            product_results = ticket_index.product(args.product)
+            if args.tickets:
+                # Only list releases of the requested tickets in product.
+                results = {
+                    ticket: product_results.get(ticket, []) for ticket in results
+                }
+            else:
+                results = product_results
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    ticket: [release._asdict() for release in releases]
+                    for ticket, releases in results.items()
+                },
+                indent=1,
+            )
+        )
+    else:
+        for ticket in sorted(results, key=ticket_key):
+            if not results[ticket]:
+                print(f"{ticket}: not shipped in any indexed tag")
+            for n, release in enumerate(results[ticket]):
+                print(
+                    f"{ticket}: {'also in' if n else 'first shipped in'} "
+                    f"{release.tag} ({release.date}) [{', '.join(release.products)}]"
+                )
+    return 0 if all(results.values()) and results else 1
+
+
+def positive_int(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, not {value}")
+    return int(value)
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
     group = parser.add_mutually_exclusive_group()
-    group.add_argument('--weekly', action='store_const', const=r"w_20", dest='tag_prefix')
-    group.add_argument('--release', action='store_const', const=r"v\d\d", dest='tag_prefix')
+    group.add_argument('--weekly', action='store_const', const=VIEW_PREFIXES["weekly"], dest='tag_prefix')
+    group.add_argument('--release', action='store_const', const=VIEW_PREFIXES["release"], dest='tag_prefix')
     group.add_argument('--tag-prefix')
+    parser.add_argument(
+        '--view',
+        nargs=2,
+        action='append',
+        default=[],
+        metavar=('TAG_PREFIX', 'OUTPUT_DIR'),
+        help="Also write the changelog for TAG_PREFIX (a pattern, or weekly "
+        "or release) to OUTPUT_DIR. May be repeated; all views share "
+        "repositories, caches and workers.",
+    )
     parser.add_argument('--debug', action='store_true')
-    return parser.parse_args()
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help="Log progress, stage timings and repository sizes",
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=NETWORK_WORKERS,
+        help="Number of concurrent network operations (downloads, clones, fetches)",
+    )
+    parser.add_argument(
+        '--since',
+        metavar="TAG|YYYY-MM-DD",
+        help="Only consider tags from this tag or date onwards. Dates can "
+        "only be used with weeklies, whose dates follow from their names",
+    )
+    parser.add_argument(
+        '--last',
+        type=positive_int,
+        metavar="N",
+        help="Only consider the N most recent tags",
+    )
+    parser.add_argument(
+        '--output-dir',
+        help="Write per-year/per-series HTML and JSON shards here, rather "
+        "than a single page to standard output",
+    )
+    parser.add_argument(
+        '--no-store',
+        action='store_true',
+        help="Recompute the full history rather than re-using stored entries",
+    )
+    parser.add_argument(
+        '--profile',
+        metavar="FILE",
+        help="Write the number and duration of git and HTTP calls, cache hit "
+        "counts and stage timings to FILE as JSON",
+    )
+    parser.add_argument(
+        '--watch',
+        type=float,
+        metavar="SECONDS",
+        help="Keep running, polling for new tags and branch updates every "
+        "SECONDS and regenerating output when anything changes",
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    lookup_parser = subparsers.add_parser(
+        'lookup',
+        help="Report the tags which shipped tickets, from the ticket index "
+        "recorded by previous runs, without using git or the network",
+    )
+    lookup_parser.add_argument('tickets', nargs='*', metavar='TICKET')
+    lookup_parser.add_argument(
+        '--product', help="List tickets shipped in this product"
+    )
+    lookup_parser.add_argument('--index', default=TICKET_INDEX)
+    lookup_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'lookup' and not (args.tickets or args.product):
+        lookup_parser.error("specify at least one ticket or --product")
+    if args.watch is not None and (
+        (args.tag_prefix or not args.view) and not args.output_dir
+    ):
+        parser.error("--watch requires an output directory for every view")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
-    eups = Eups(pattern=args.tag_prefix)
-    print_changelog(generate_changelog(eups), eups.all_products)
+    elif args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    views: List[Tuple[str, Optional[str]]] = [
+        (VIEW_PREFIXES.get(tag_prefix, tag_prefix), output_dir)
+        for tag_prefix, output_dir in args.view
+    ]
+    if args.tag_prefix or not views:
+        views.insert(0, (args.tag_prefix, args.output_dir))
+    if args.command == 'lookup':
+        sys.exit(lookup(args))
+    with JiraCache() as jira:
+        if args.watch is not None:
+            watch(views, args, jira)
+        else:
+            try:
+                run_views(views, args, jira)
+            except TagSelectionError as e:
+                sys.exit(f"error: {e}")
+    products.log_disk_usage()
@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+import re
+
+from typing import Any, Dict, Optional
+
+from .config import CHANGELOG_STORE_DIR
+from .typing import ChangelogEntry
+from .utils import write_json_atomically
+
+STORE_VERSION = 1
+
+
+class ChangelogStore(object):
+    """Persistent record of changelog entries computed on previous runs.
+
+    Each entry is recorded against the tag it was diffed with, so that it is
+    only re-used if that predecessor is unchanged. Entries also record the
+    products which couldn't be diffed, so that only those are retried.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.info(f"No usable changelog store at {self.path}: {e}")
+        else:
+            if content.get("version") == STORE_VERSION:
+                self._entries = content["tags"]
+
+    @classmethod
+    def for_pattern(
+        cls, pattern: str, store_dir: str = CHANGELOG_STORE_DIR
+    ) -> "ChangelogStore":
+        slug = re.sub(r"\W", "_", pattern)
+        return cls(os.path.join(store_dir, f"changelog-{slug}.json"))
+
+    def get(self, tag_name: str, previous_tag_name: str) -> Optional[ChangelogEntry]:
+        entry = self._entries.get(tag_name)
+        if entry is None or entry["previous"] != previous_tag_name:
+            return None
+        return ChangelogEntry.from_names(
+            entry["added"],
+            entry["dropped"],
+            entry["tickets"],
+            entry.get("failed", []),
+        )
+
+    def put(
+        self, tag_name: str, previous_tag_name: str, entry: ChangelogEntry
+    ) -> None:
+        self._entries[tag_name] = {
+            "previous": previous_tag_name,
+            "added": sorted(entry.added),
+            "dropped": sorted(entry.dropped),
+            "failed": sorted(entry.failed),
+            "tickets": {
+                ticket: sorted(products) for ticket, products in entry.tickets.items()
+            },
+        }
+
+    def save(self) -> None:
+        write_json_atomically(
+            self.path, {"version": STORE_VERSION, "tags": self._entries}
+        )
@@ -0,0 +1,119 @@
+import heapq
+import json
+import logging
+import threading
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .utils import write_json_atomically
+
+INDEX_VERSION = 1
+
+# sha → (parents, generation, is merge, ticket)
+IndexEntry = Tuple[Tuple[str, ...], int, bool, Optional[str]]
+
+
+class CommitIndex(object):
+    """Persistent index of the commits in a repository.
+
+    Each commit records its parents, its generation number (one more than
+    the largest generation of its parents), whether it's a merge, and the
+    ticket named in its subject. Generation numbers let range queries walk
+    only the commits that differ between the endpoints.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._commits: Dict[str, IndexEntry] = {}
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            pass
+        else:
+            if content.get("version") == INDEX_VERSION:
+                self._commits = {
+                    sha: (tuple(parents), generation, is_merge, ticket)
+                    for sha, (parents, generation, is_merge, ticket) in content[
+                        "commits"
+                    ].items()
+                }
+
+    def __contains__(self, sha: str) -> bool:
+        return sha in self._commits
+
+    def __len__(self) -> int:
+        return len(self._commits)
+
+    def tips(self) -> Set[str]:
+        """Commits in the index which are not the parent of any other."""
+        with self._lock:
+            parents = {p for entry in self._commits.values() for p in entry[0]}
+            return set(self._commits) - parents
+
+    def add(
+        self, commits: Iterable[Tuple[str, Tuple[str, ...], Optional[str]]]
+    ) -> int:
+        """Add (sha, parents, ticket) for each of commits, which must be
+        ordered parents first. Returns the number of commits added.
+        """
+        added = 0
+        with self._lock:
+            for sha, parents, ticket in commits:
+                if sha in self._commits:
+                    continue
+                generation = 1 + max(
+                    (self._commits[p][1] for p in parents if p in self._commits),
+                    default=0,
+                )
+                self._commits[sha] = (parents, generation, len(parents) > 1, ticket)
+                added += 1
+        return added
+
+    def save(self) -> None:
+        with self._lock:
+            write_json_atomically(
+                self.path, {"version": INDEX_VERSION, "commits": self._commits}
+            )
+
+    def symmetric_difference(self, a: str, b: str) -> List[str]:
+        """Commits reachable from exactly one of a and b, as ``git log a...b``.
+
+        Raises KeyError if either a or b is not indexed.
+        """
+        commits = self._commits
+        # Bit 1: reachable from a; bit 2: reachable from b.
+        flags = {a: 1}
+        flags[b] = flags.get(b, 0) | 2
+        queue = [(-commits[sha][1], sha) for sha in flags]
+        heapq.heapify(queue)
+        visited: Set[str] = set()
+        result = []
+
+        # Popping in decreasing generation order guarantees that every child
+        # of a commit has been visited, so its flags are final, before it is.
+        while queue and any(flags[sha] != 3 for _, sha in queue):
+            _, sha = heapq.heappop(queue)
+            if sha in visited:
+                continue
+            visited.add(sha)
+            if flags[sha] != 3:
+                result.append(sha)
+            for parent in commits[sha][0]:
+                if parent not in commits:
+                    continue
+                parent_flags = flags.get(parent, 0) | flags[sha]
+                if parent_flags != flags.get(parent):
+                    flags[parent] = parent_flags
+                    heapq.heappush(queue, (-commits[parent][1], parent))
+        return result
+
+    def merge_tickets_between(self, a: str, b: str) -> Set[str]:
+        """Tickets named by merges reachable from exactly one of a and b."""
+        tickets = set()
+        for sha in self.symmetric_difference(a, b):
+            _, _, is_merge, ticket = self._commits[sha]
+            if is_merge and ticket:
+                tickets.add(ticket)
+        return tickets
@@ -1,6 +1,8 @@
 import os
 import datetime
 
+from typing import List, Optional
+
 JIRA_API_URL = "https://jira.lsstcorp.org/rest/api/2"
 EUPS_PKGROOT = "https://eups.lsst.codes/stack/src/"
 REPOS_YAML = "https://raw.githubusercontent.com/lsst/repos/master/etc/repos.yaml"
@@ -12,17 +14,54 @@ TARGET_DIR = os.path.expanduser("~/repos")
 # Should be within the above so tha it's also cached.
 TICKET_CACHE = os.path.join(TARGET_DIR, "ticket.cache")
 
-# These products are skipped because they are huge (and so blow our storage
-# quota in GitHub Actions) but don't add much interesting information.
-PRODUCT_SKIPLIST = [
-    "boost",
-    "galsim",
-    "mariadb",
-    "mariadbclient",
-    "qserv_distrib",
-    "qserv_testdata",
-    "sims_skybrightness_data",
-]
+# Tickets per Jira search request, and concurrent requests, when prefetching.
+JIRA_BATCH_SIZE = 100
+JIRA_FETCH_WORKERS = 4
+
+# Tickets which could not be retrieved are not retried for this many hours.
+JIRA_NEGATIVE_TTL = 24
+
+# Tickets merged between pairs of commits, keyed by resolved SHAs.
+RANGE_CACHE = os.path.join(TARGET_DIR, "range.cache")
+
+# Bump this whenever the range cache format or ticket extraction changes, so
+# that stale results are discarded.
+RANGE_CACHE_VERSION = "1"
+
+# Range cache entries not used within this many days are evicted.
+RANGE_CACHE_MAX_AGE = 90
+
+# How to query git objects: "cat-file" keeps a git cat-file process running
+# for each repository; "subprocess" starts a new git for every query.
+GIT_BACKEND = "cat-file"
+
+# Number of concurrent tasks using the network (downloads, clones and
+# fetches) and running local git commands.
+NETWORK_WORKERS = 8
+GIT_WORKERS = 8
+
+# Digest of the branch tip and tags last fetched from each product's origin;
+# repositories whose origin is unchanged aren't fetched.
+REMOTE_HEADS = os.path.join(TARGET_DIR, "remote-heads.json")
+
+# Tags and products in which each ticket shipped, for quick lookups.
+TICKET_INDEX = os.path.join(TARGET_DIR, "tickets.sqlite3")
+
+# Downloaded EUPS tag manifests.
+EUPS_MANIFEST_CACHE = os.path.join(TARGET_DIR, "manifests")
+
+# Previously generated changelog entries, one file per tag pattern.
+CHANGELOG_STORE_DIR = os.path.join(TARGET_DIR, "changelog")
+
+# Repositories are cloned with this filter (see ``git clone --filter``). We
+# only read commits and refs, so there's no need to download any file content.
+# Set to None for full clones.
+CLONE_FILTER: Optional[str] = "blob:none"
+
+# Products listed here are not cloned or tagged. This used to be necessary to
+# keep huge repositories (boost, galsim, ...) within our storage quota in
+# GitHub Actions, but partial clones make that unnecessary.
+PRODUCT_SKIPLIST: List[str] = []
 TAG_SKIPLIST = ["w_2019_30", "v12_1_1", "v12_1_2_rc1", "v12_1_2"]
 
 RELEASE_DATES = {
@@ -1,41 +1,138 @@
+import json
 import logging
+import os
 import re
 
-from collections import Mapping
-from concurrent.futures import ThreadPoolExecutor
+from collections import Mapping, defaultdict
+from concurrent.futures import Future
 from datetime import datetime
 from subprocess import CalledProcessError
 from urllib.request import urlopen
 
-from typing import Any, Iterable, Iterator, List, Tuple, Set
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Set
 
 from lxml import html  # type: ignore
 
-from .config import EUPS_PKGROOT, TAG_SKIPLIST, PRODUCT_SKIPLIST
-from .utils import infer_release_date, git_ref_from_eups_version
+from .config import (
+    EUPS_MANIFEST_CACHE,
+    EUPS_PKGROOT,
+    TAG_SKIPLIST,
+    PRODUCT_SKIPLIST,
+)
+from .fetch import ConnectionPool
+from .ids import PRODUCTS
+from .profile import PROFILE
+from .scheduler import Scheduler
+from .utils import (
+    estimate_tag_date,
+    git_ref_from_eups_version,
+    infer_release_date,
+    tag_sort_key,
+    write_json_atomically,
+    write_text_atomically,
+)
 
-def tag_product(products, product_name, tag_name, product_version, fallback_date):
+class TagSelectionError(ValueError):
+    """No usable set of tags could be selected."""
+
+
+def select_tags(
+    tag_names: Iterable[str], since: Optional[str] = None, last: Optional[int] = None
+) -> List[str]:
+    """Restrict tag_names to those released since since (a tag name or a
+    YYYY-MM-DD date) and/or the last of them, plus the tag immediately before
+    the first selected, against which it will be compared.
+
+    Tags are ordered by name (see tag_sort_key), so that this can be done
+    before retrieving any manifests. A date can only be used if the date of
+    every tag can be estimated from its name (see estimate_tag_date), which
+    is not the case for most releases; TagSelectionError is raised if not,
+    if since is neither a date nor one of tag_names, or if no tags are
+    selected.
+    """
+    ordered = sorted(tag_names, key=tag_sort_key)
+    if last is not None and last < 1:
+        raise TagSelectionError(f"Can't select the last {last} tags")
+    first = 0
+    if since is not None:
+        try:
+            since_date = datetime.strptime(since, "%Y-%m-%d")
+        except ValueError:
+            if since not in ordered:
+                raise TagSelectionError(
+                    f"{since} is neither a YYYY-MM-DD date nor a known tag"
+                )
+            first = ordered.index(since)
+        else:
+            undated = [
+                tag_name for tag_name in ordered if estimate_tag_date(tag_name) is None
+            ]
+            if undated:
+                raise TagSelectionError(
+                    f"Can't select tags by date, since the dates of tags such "
+                    f"as {undated[0]} can't be estimated; give a tag name instead"
+                )
+            first = next(
+                (
+                    n
+                    for n, tag_name in enumerate(ordered)
+                    if estimate_tag_date(tag_name) >= since_date  # type: ignore[operator]
+                ),
+                len(ordered),
+            )
+    if last is not None:
+        first = max(first, len(ordered) - last)
+    selected = ordered[max(first - 1, 0) :]
+    if not selected:
+        raise TagSelectionError("No tags selected")
+    return selected
+
+
+def tag_product(
+    products, product_name: str, versions: Iterable[Tuple[str, str, datetime]]
+) -> None:
+    """Tag product_name with each (tag name, EUPS version, fallback date) in
+    versions which it doesn't already carry.
+
+    Versions are resolved, and tags created, with a single git call each.
+    Failures are logged.
+    """
     try:
         product = products[product_name]
     except KeyError as e:
         logging.warning(f"Repository for {product_name} not available: {e}")
-    else:
-        if tag_name not in product.tags:
-            try:
+        return
+    existing = product.tags
+    versions = [version for version in versions if version[0] not in existing]
+    try:
+        resolved = product.resolve_commits(
+            {git_ref_from_eups_version(version) for _, version, _ in versions}
+        )
+        targets = {}
+        fallbacks = []
+        for tag_name, product_version, fallback_date in versions:
+            git_ref = git_ref_from_eups_version(product_version)
+            if resolved[git_ref]:
                 # If we know the correct version, tag it directly...
-                product.add_tag(
-                    tag_name, git_ref_from_eups_version(product_version)
-                )
-            except CalledProcessError as e:
+                targets[tag_name] = resolved[git_ref]
+            else:
                 # ...otherwise, add a tag based on date.
                 logging.warning(
-                    f"Failed to tag {product_name} with version "
-                    f"{git_ref_from_eups_version(product_version)}: "
-                    f"Git said: \"{e.output.decode('utf-8').strip()}\" "
-                    f"Falling back to timestamp."
+                    f"Failed to tag {product_name} with version {git_ref} for "
+                    f"{tag_name}. Falling back to timestamp."
                 )
-                date_sha = product.sha_for_date(fallback_date)
-                product.add_tag(tag_name, date_sha)
+                fallbacks.append((tag_name, fallback_date))
+        date_shas = product.shas_for_dates(date for _, date in fallbacks)
+        for (tag_name, fallback_date), date_sha in zip(fallbacks, date_shas):
+            if date_sha:
+                targets[tag_name] = date_sha
+            else:
+                logging.warning(f"No commit on {product_name} before {fallback_date}")
+        product.add_tags(targets)
+    except CalledProcessError as e:
+        logging.warning(
+            f"Failed to tag {product_name}: {e.output.decode('utf-8').strip()}"
+        )
 
 
 class EupsTag(object):
@@ -46,53 +143,185 @@ class EupsTag(object):
         product_list: Iterable[Tuple[str, str]],
     ):
         self.name = name
-        self.products = [product[0] for product in product_list]
+        self.versions: Dict[str, str] = dict(product_list)
+        self.products = list(self.versions)
+        self.product_bits = PRODUCTS.bits(self.products)
 
         # If we can infer a release date based on the tag name, then use that.
         # Otherwise, use the candidate date supplied (e.g. from HTTP).
         self.date = infer_release_date(self.name) or candidate_date
 
-        from .products import products
-        with ThreadPoolExecutor() as executor:
-            for (product_name, product_version) in product_list:
-                if self.name == "master":
-                    continue
-                executor.submit(tag_product, products, product_name, self.name, product_version, self.date)
-
     def __lt__(self, other):
-        logging.info(f"{self.name}, {self.date}")
-        logging.info(f"{other.name}, {self.date}")
         return self.date < other.date
 
 
 class Eups(Mapping):
-    def __init__(self, *, pkgroot: str = EUPS_PKGROOT, pattern: str = "w_latest"):
+    """EUPS tags matching pattern, as published under pkgroot.
+
+    Tag manifests are cached in manifest_cache. Published manifests don't
+    change, so cached copies are used without contacting the server unless
+    revalidate is set or the tag name suggests that it moves (e.g.
+    ``w_latest``), in which case they are revalidated with a conditional
+    request.
+    """
+
+    def __init__(
+        self,
+        *,
+        pkgroot: str = EUPS_PKGROOT,
+        pattern: str = "w_latest",
+        manifest_cache: Optional[str] = EUPS_MANIFEST_CACHE,
+        revalidate: bool = False,
+        scheduler: Optional[Scheduler] = None,
+        since: Optional[str] = None,
+        last: Optional[int] = None,
+    ):
+        """Manifests are retrieved before returning. Materializing and tagging
+        the products is scheduled on scheduler, if supplied, in which case
+        ``tagging`` holds a future for each product which completes when it
+        has been tagged. Otherwise, all the work is completed before
+        returning.
+
+        If since or last are given, only a window of tags is considered (see
+        select_tags). TagSelectionError is raised if there are no tags.
+        """
         self._pkgroot = pkgroot
         self._pattern = pattern
+        self._manifest_cache = manifest_cache
+        self._revalidate = revalidate
+        self._pool = ConnectionPool("Eups")
+        own_scheduler = scheduler is None
+        if scheduler is None:
+            scheduler = Scheduler()
+
+        tag_names = self.tag_names(pkgroot=pkgroot, pattern=pattern)
+        if since is not None or last is not None:
+            tag_names = select_tags(tag_names, since, last)
+        if not tag_names:
+            raise TagSelectionError(f"No tags match {pattern}")
+        manifests = [
+            future.result()
+            for future in [
+                scheduler.submit(
+                    "network", self.__retrieve_manifest, tag_name, stage="manifest"
+                )
+                for tag_name in tag_names
+            ]
+        ]
+        product_lists = [self.__parse_manifest(manifest) for _, manifest in manifests]
         self._tags = {
-            tag_name: self.__retrieve_tag(tag_name)
-            for tag_name in self.__retrieve_tag_list()
+            tag_name: EupsTag(tag_name, tag_date, product_list)
+            for tag_name, (tag_date, _), product_list in zip(
+                tag_names, manifests, product_lists
+            )
         }
 
-    def __retrieve_tag_list(self) -> List[str]:
+        # Group versions by product, so each repository is tagged in one go,
+        # as soon as it has been materialized.
+        versions = defaultdict(list)
+        for tag_name, product_list in zip(tag_names, product_lists):
+            for product_name, product_version in product_list:
+                versions[product_name].append(
+                    (tag_name, product_version, self._tags[tag_name].date)
+                )
+        from .products import products
+        self.tagging: Dict[str, Future] = {}
+        for product_name, product_versions in sorted(versions.items()):
+            materialized = scheduler.submit(
+                "network", products.prepare, product_name, stage="materialize"
+            )
+            self.tagging[product_name] = scheduler.submit(
+                "git",
+                tag_product,
+                products,
+                product_name,
+                product_versions,
+                after=[materialized],
+                stage="tag",
+            )
+
+        if own_scheduler:
+            scheduler.shutdown()
+            for future in self.tagging.values():
+                future.result()
+
+    @staticmethod
+    def tag_names(
+        *, pkgroot: str = EUPS_PKGROOT, pattern: str = "w_latest"
+    ) -> List[str]:
+        """Names of the tags matching pattern published under pkgroot."""
         logging.debug("Fetching tag list")
-        h = html.parse(urlopen(self._pkgroot + "/tags"))
+        with PROFILE.timed(http="Eups/tags"):
+            h = html.parse(urlopen(pkgroot + "/tags"))
         return [
             el.text[:-5]
             for el in h.findall("./body/table/tr/td/a")
             if el.text[-5:] == ".list"
-            and re.match(self._pattern, el.text)
+            and re.match(pattern, el.text)
             and not el.text[:-5] in TAG_SKIPLIST
         ]
 
-    def __retrieve_tag(self, tag_name: str) -> EupsTag:
+    def __retrieve_manifest(self, tag_name: str) -> Tuple[datetime, str]:
+        """Return the last-modified date and content of the manifest for
+        tag_name, from the cache if possible.
+        """
+        cached = self.__read_cached_manifest(tag_name)
+        if cached and not (self._revalidate or tag_name.endswith("latest")):
+            logging.debug(f"Using cached tag {tag_name}")
+            return cached[1], cached[2]
+
         logging.debug(f"Fetching tag {tag_name}")
-        u = urlopen(f"{self._pkgroot}/tags/{tag_name}.list")
-        tag_date = datetime.strptime(
-            u.info()["last-modified"], "%a, %d %b %Y %H:%M:%S %Z"
+        headers = {"If-Modified-Since": cached[0]} if cached else {}
+        status, response_headers, body = self._pool.get(
+            f"{self._pkgroot}/tags/{tag_name}.list", headers, endpoint="manifest"
         )
+        if status == 304 and cached:
+            return cached[1], cached[2]
+        if status != 200:
+            raise IOError(f"Failed to retrieve tag {tag_name}: HTTP {status}")
+        last_modified = response_headers["last-modified"]
+        manifest = body.decode("utf-8")
+        self.__write_cached_manifest(tag_name, last_modified, manifest)
+        return self.__parse_date(last_modified), manifest
+
+    @staticmethod
+    def __parse_date(last_modified: str) -> datetime:
+        return datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z")
+
+    def __read_cached_manifest(
+        self, tag_name: str
+    ) -> Optional[Tuple[str, datetime, str]]:
+        if not self._manifest_cache:
+            return None
+        path = os.path.join(self._manifest_cache, f"{tag_name}.list")
+        try:
+            with open(f"{path}.json") as f:
+                last_modified = json.load(f)["last-modified"]
+            with open(path) as f:
+                manifest = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return last_modified, self.__parse_date(last_modified), manifest
+
+    def __write_cached_manifest(
+        self, tag_name: str, last_modified: str, manifest: str
+    ) -> None:
+        if not self._manifest_cache:
+            return
+        path = os.path.join(self._manifest_cache, f"{tag_name}.list")
+        # A manifest is only used if it has a sidecar, so remove that while
+        # the manifest is replaced, in case we are interrupted in between.
+        try:
+            os.remove(f"{path}.json")
+        except FileNotFoundError:
+            pass
+        write_text_atomically(path, manifest)
+        write_json_atomically(f"{path}.json", {"last-modified": last_modified})
+
+    @staticmethod
+    def __parse_manifest(manifest: str) -> List[Tuple[str, str]]:
         products = []
-        for line in u.read().decode("utf-8").strip().split("\n"):
+        for line in manifest.strip().split("\n"):
             if line.startswith("EUPS distribution "):
                 continue
             if line.strip()[0] == "#":
@@ -101,7 +330,7 @@ class Eups(Mapping):
                 product_name, _, product_version = line.split()
                 if product_name not in PRODUCT_SKIPLIST:
                     products.append((product_name, product_version))
-        return EupsTag(tag_name, tag_date, products)
+        return products
 
     def __getitem__(self, tag_name: str) -> EupsTag:
         return self._tags[tag_name]
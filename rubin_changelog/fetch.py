@@ -0,0 +1,65 @@
+import http.client
+import logging
+import threading
+
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .profile import PROFILE
+
+
+class ConnectionPool(object):
+    """Re-use keep-alive HTTP(S) connections, one per host per thread.
+
+    Requests are profiled under name, plus the endpoint given for each.
+    """
+
+    def __init__(self, name: str, *, timeout: float = 60):
+        self.__name = name
+        self.__timeout = timeout
+        self.__local = threading.local()
+
+    def __connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self.__local.__dict__.setdefault("connections", {})
+        if (scheme, netloc) not in connections:
+            connection_class = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            connections[(scheme, netloc)] = connection_class(
+                netloc, timeout=self.__timeout
+            )
+        return connections[(scheme, netloc)]
+
+    def get(
+        self,
+        url: str,
+        headers: Optional[Mapping[str, str]] = None,
+        *,
+        endpoint: str = "",
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Return status, headers and body from a GET of url.
+
+        Header names are lower-cased.
+        """
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        logging.debug(url)
+        connection = self.__connection(parts.scheme, parts.netloc)
+        with PROFILE.timed(http=f"{self.__name}/{endpoint}".rstrip("/")):
+            try:
+                connection.request("GET", path, headers=dict(headers or {}))
+                response = connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have closed an idle keep-alive connection;
+                # reconnect and retry once.
+                connection.close()
+                connection.request("GET", path, headers=dict(headers or {}))
+                response = connection.getresponse()
+            body = response.read()
+        return (
+            response.status,
+            {k.lower(): v for k, v in response.getheaders()},
+            body,
+        )
@@ -0,0 +1,181 @@
+import io
+import logging
+import subprocess
+import threading
+
+from abc import ABC, abstractmethod
+from typing import IO, Iterator, List, NamedTuple, Optional
+
+from .profile import PROFILE
+
+
+def call_git(
+    *args: str,
+    cwd: str,
+    git_exec: str = "/usr/bin/git",
+    input: Optional[str] = None,
+    repository: Optional[str] = None,
+) -> str:
+    """Run git in cwd, returning its output.
+
+    The call is profiled against repository, which defaults to cwd; it
+    should be given when cwd is not the repository concerned, as when
+    cloning.
+    """
+    to_exec = [git_exec] + list(args)
+
+    logging.debug(to_exec)
+    logging.debug(cwd)
+    with PROFILE.timed(git_command=args[0], git_repository=repository or cwd):
+        return subprocess.check_output(
+            to_exec,
+            cwd=cwd,
+            stderr=subprocess.STDOUT,
+            input=input.encode("utf-8") if input is not None else None,
+        ).decode("utf-8")
+
+
+def stream_git(
+    *args: str, cwd: str, git_exec: str = "/usr/bin/git", separator: bytes = b"\0"
+) -> Iterator[str]:
+    """Run git and yield its output one separator-delimited field at a time,
+    without buffering the whole output in memory.
+
+    Fields are separated, not terminated, by separator, so the last field is
+    yielded even if it is empty; nothing is yielded if there is no output.
+    """
+    to_exec = [git_exec] + list(args)
+
+    logging.debug(to_exec)
+    logging.debug(cwd)
+    with PROFILE.timed(git_command=args[0], git_repository=cwd), subprocess.Popen(
+        to_exec, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as proc:
+        pending = b""
+        output = False
+        for chunk in iter(lambda: proc.stdout.read(65536), b""):  # type: ignore[union-attr]
+            output = True
+            pending += chunk
+            *fields, pending = pending.split(separator)
+            for field in fields:
+                yield field.decode("utf-8")
+        if output:
+            yield pending.decode("utf-8")
+        stderr = proc.stderr.read()  # type: ignore[union-attr]
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, to_exec, stderr)
+
+
+class GitObject(NamedTuple):
+    sha: str
+    type: str
+    data: bytes
+
+
+def _read_batch_entry(stream: IO[bytes]) -> Optional[GitObject]:
+    """Read one object, as emitted by ``git cat-file --batch``, from stream.
+
+    Returns None if git reported the object as missing or ambiguous.
+    """
+    header = stream.readline().decode("utf-8").split()
+    if not header:
+        raise EOFError("git cat-file exited unexpectedly")
+    if len(header) != 3 or not header[2].isdigit():
+        return None
+    sha, object_type, size = header
+    data = stream.read(int(size) + 1)[:-1]  # Strip trailing newline.
+    return GitObject(sha, object_type, data)
+
+
+class GitBackend(ABC):
+    """Interface for retrieving objects from the repository at path."""
+
+    def __init__(self, path: str, *, git_exec: str = "/usr/bin/git"):
+        self.path = path
+        self.git_exec = git_exec
+
+    @abstractmethod
+    def read_objects(self, names: List[str]) -> List[Optional[GitObject]]:
+        """Return the object named by each of names (which may be any
+        expression understood by ``git rev-parse``), or None if there is no
+        such object.
+        """
+
+    def reset(self) -> None:
+        """Discard any state which may be invalidated by changes to refs."""
+
+    def close(self) -> None:
+        pass
+
+
+class SubprocessBackend(GitBackend):
+    """Run a fresh ``git cat-file --batch`` for every query."""
+
+    def read_objects(self, names: List[str]) -> List[Optional[GitObject]]:
+        if not names:
+            return []
+        with PROFILE.timed(git_command="cat-file", git_repository=self.path):
+            output = subprocess.check_output(
+                [self.git_exec, "cat-file", "--batch"],
+                cwd=self.path,
+                input="".join(f"{name}\n" for name in names).encode("utf-8"),
+                stderr=subprocess.STDOUT,
+            )
+        stream = io.BytesIO(output)
+        return [_read_batch_entry(stream) for _ in names]
+
+
+class CatFileBackend(GitBackend):
+    """Answer queries from a long-lived ``git cat-file --batch`` coprocess,
+    started on first use.
+    """
+
+    def __init__(self, path: str, *, git_exec: str = "/usr/bin/git"):
+        super().__init__(path, git_exec=git_exec)
+        self.__lock = threading.Lock()
+        self.__proc: Optional[subprocess.Popen] = None
+
+    def __start(self) -> subprocess.Popen:
+        if self.__proc is None or self.__proc.poll() is not None:
+            logging.debug(f"Starting git cat-file --batch in {self.path}")
+            PROFILE.record(0.0, git_command="cat-file", git_repository=self.path)
+            self.__proc = subprocess.Popen(
+                [self.git_exec, "cat-file", "--batch"],
+                cwd=self.path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self.__proc
+
+    def read_objects(self, names: List[str]) -> List[Optional[GitObject]]:
+        if not names:
+            return []
+        # Queries don't start a process, so are profiled separately.
+        with self.__lock, PROFILE.timed(cat_file_queries=self.path):
+            proc = self.__start()
+            proc.stdin.write(  # type: ignore[union-attr]
+                "".join(f"{name}\n" for name in names).encode("utf-8")
+            )
+            proc.stdin.flush()  # type: ignore[union-attr]
+            return [_read_batch_entry(proc.stdout) for _ in names]  # type: ignore[arg-type]
+
+    def reset(self) -> None:
+        # Refs or packs may have changed under a running process; start a new
+        # one on next use.
+        self.close()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__proc is not None:
+                self.__proc.stdin.close()  # type: ignore[union-attr]
+                self.__proc.wait()
+                self.__proc.stdout.close()  # type: ignore[union-attr]
+                self.__proc = None
+
+
+BACKENDS = {"subprocess": SubprocessBackend, "cat-file": CatFileBackend}
+
+
+def make_backend(name: str, path: str) -> GitBackend:
+    return BACKENDS[name](path)
@@ -0,0 +1,50 @@
+import threading
+
+from typing import Dict, Iterable, Iterator, List
+
+
+class Interner(object):
+    """Assign a small integer ID to each distinct name.
+
+    Sets of names may then be represented as bitsets: Python ints in which
+    bit n is set if the name with ID n is a member.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def id(self, name: str) -> int:
+        try:
+            return self._ids[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._ids:
+                    self._ids[name] = len(self._names)
+                    self._names.append(name)
+                return self._ids[name]
+
+    def name(self, id: int) -> str:
+        return self._names[id]
+
+    def bits(self, names: Iterable[str]) -> int:
+        result = 0
+        for name in names:
+            result |= 1 << self.id(name)
+        return result
+
+    def names(self, bits: int) -> Iterator[str]:
+        for id in ids_from_bits(bits):
+            yield self._names[id]
+
+
+def ids_from_bits(bits: int) -> Iterator[int]:
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+PRODUCTS = Interner()
+TICKETS = Interner()
@@ -1,32 +1,170 @@
 import dbm
+import http.client
 import json
 import logging
+import os
+import threading
+import time
 
-from urllib.request import urlopen
-from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlencode
 
-from rubin_changelog.config import JIRA_API_URL, TICKET_CACHE
+from rubin_changelog.config import (
+    JIRA_API_URL,
+    JIRA_BATCH_SIZE,
+    JIRA_FETCH_WORKERS,
+    JIRA_NEGATIVE_TTL,
+    TICKET_CACHE,
+)
+from rubin_changelog.fetch import ConnectionPool
+from rubin_changelog.profile import PROFILE
+
+NOT_AVAILABLE = "Ticket description not available"
 
 
 class JiraCache(object):
+    """Ticket summaries, cached on disk.
+
+    A single handle on the cache is held open until close() is called. Tickets
+    which can't be retrieved are recorded as such, and not retried for
+    negative_ttl hours.
+    """
+
     def __init__(
-        self, *, api_root: str = JIRA_API_URL, cache_location: str = TICKET_CACHE
+        self,
+        *,
+        api_root: str = JIRA_API_URL,
+        cache_location: str = TICKET_CACHE,
+        negative_ttl: float = JIRA_NEGATIVE_TTL,
     ):
         self.__api_root = api_root
-        self.__cache_location = cache_location
+        self.__negative_ttl = negative_ttl * 3600
+        self.__pool = ConnectionPool("JiraCache")
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_location), exist_ok=True)
+        self.__db = dbm.open(cache_location, "c")  # type: ignore[attr-defined]
 
     def __url_for_ticket(self, ticket: str) -> str:
         return f"{self.__api_root}/issue/{ticket}?fields=summary"
 
+    def __url_for_search(self, tickets: Iterable[str]) -> str:
+        query = {
+            "jql": f"key in ({','.join(tickets)})",
+            "fields": "summary",
+            "maxResults": JIRA_BATCH_SIZE,
+            # Skip unknown keys rather than rejecting the whole query.
+            "validateQuery": "warn",
+        }
+        return f"{self.__api_root}/search?{urlencode(query)}"
+
+    @staticmethod
+    def __negative_key(ticket: str) -> str:
+        return f"!{ticket}"
+
+    def __is_known(self, ticket: str) -> bool:
+        """Return True if ticket is cached, or recently failed to retrieve."""
+        with self.__lock:
+            if ticket in self.__db:
+                return True
+            failed_at = self.__db.get(self.__negative_key(ticket))
+        return (
+            failed_at is not None
+            and time.time() - float(failed_at) < self.__negative_ttl
+        )
+
+    def __store(self, summaries: Dict[str, Optional[str]]) -> None:
+        with self.__lock:
+            for ticket, summary in summaries.items():
+                if summary is None:
+                    self.__db[self.__negative_key(ticket)] = str(time.time())
+                else:
+                    self.__db[ticket] = summary.encode("utf-8")
+
+    def __fetch_one(self, ticket: str) -> Optional[str]:
+        try:
+            status, _, body = self.__pool.get(
+                self.__url_for_ticket(ticket), endpoint="issue"
+            )
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning(f"Failed to retrieve {ticket}: {e!r}")
+            return None
+        if status != 200:
+            logging.warning(f"Failed to retrieve {ticket}: HTTP {status}")
+            return None
+        try:
+            return json.loads(body)["fields"]["summary"]
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Unexpected response for {ticket}: {e!r}")
+            return None
+
+    def fetch_batch(self, tickets: List[str]) -> None:
+        """Retrieve and cache all of tickets with a single search."""
+        try:
+            status, _, body = self.__pool.get(
+                self.__url_for_search(tickets), endpoint="search"
+            )
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning(f"Ticket search failed: {e!r}")
+            status = None
+        if status == 200:
+            try:
+                found = {
+                    issue["key"].upper(): issue["fields"]["summary"]
+                    for issue in json.loads(body)["issues"]
+                }
+            except (ValueError, KeyError, TypeError) as e:
+                # Leave the tickets to be retrieved individually if needed.
+                logging.warning(f"Unexpected ticket search response: {e!r}")
+                return
+            # Anything not returned (e.g. moved or not visible) is missing.
+            summaries: Dict[str, Optional[str]] = {
+                ticket: found.get(ticket.upper()) for ticket in tickets
+            }
+        else:
+            # Fall back to asking about each ticket in turn, in case the
+            # search itself is at fault.
+            summaries = {ticket: self.__fetch_one(ticket) for ticket in tickets}
+        self.__store(summaries)
+
+    def batches(self, tickets: Iterable[str]) -> List[List[str]]:
+        """Divide those of tickets which are not already cached into batches
+        for fetch_batch.
+        """
+        requested = set(tickets)
+        missing = sorted(
+            ticket for ticket in requested if not self.__is_known(ticket)
+        )
+        PROFILE.count("JiraCache prefetch", "hits", len(requested) - len(missing))
+        PROFILE.count("JiraCache prefetch", "misses", len(missing))
+        logging.info(f"Prefetching {len(missing)} tickets")
+        return [
+            missing[i : i + JIRA_BATCH_SIZE]
+            for i in range(0, len(missing), JIRA_BATCH_SIZE)
+        ]
+
+    def prefetch(
+        self, tickets: Iterable[str], *, max_workers: int = JIRA_FETCH_WORKERS
+    ) -> None:
+        """Retrieve all of tickets which are not already cached, in batches."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self.fetch_batch, self.batches(tickets)))
+
     def __getitem__(self, ticket: str) -> str:
-        with dbm.open(self.__cache_location, "c") as db:  # type: ignore[attr-defined]
-            if ticket not in db:
-                url = self.__url_for_ticket(ticket)
-                logging.debug(url)
-                try:
-                    db[ticket] = json.load(urlopen(url))["fields"]["summary"].encode(
-                        "utf-8"
-                    )
-                except URLError:
-                    return "Ticket description not available"
-            return db[ticket].decode("utf-8")
+        if self.__is_known(ticket):
+            PROFILE.count("JiraCache", "hits")
+        else:
+            PROFILE.count("JiraCache", "misses")
+            self.__store({ticket: self.__fetch_one(ticket)})
+        with self.__lock:
+            summary = self.__db.get(ticket)
+        return summary.decode("utf-8") if summary is not None else NOT_AVAILABLE
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __enter__(self) -> "JiraCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
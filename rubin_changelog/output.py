@@ -1,54 +1,220 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Mapping, Set
+from typing import Any, Dict, List, Optional, Set, TextIO
 
 from .eups import EupsTag
 from .jira import JiraCache
-from .typing import Changelog
+from .typing import Changelog, ChangelogEntry
+
+TITLE = "Rubin Science Pipelines Changelog"
+
+# Records the content hash of every file written by write_changelog.
+SHARD_MANIFEST = "shards.json"
+
 
 def print_tag(
-    tag: EupsTag, added: Set[str], dropped: Set[str], tickets: Mapping[str, Set[str]]
+    tag: EupsTag, jira: JiraCache, entry: ChangelogEntry, out: TextIO = sys.stdout
 ):
-    print(f"<h2 id=\"{tag.name}\">{tag.name}</h2>")
+    added, dropped, tickets = entry.added, entry.dropped, entry.tickets
+    print(f"<h2 id=\"{tag.name}\">{tag.name}</h2>", file=out)
     if tag.name != "master":
-        print(f"Released {tag.date.strftime('%Y-%m-%d')}.")
+        print(f"Released {tag.date.strftime('%Y-%m-%d')}.", file=out)
     if not added and not dropped and not tickets:
-        print("No changes in this version.")
+        print("No changes in this version.", file=out)
     if added:
-        print("<h3>Products added</h3>")
-        print("<ul>")
+        print("<h3>Products added</h3>", file=out)
+        print("<ul>", file=out)
         for product_name in sorted(added):
-            print(f"<li>{product_name}</li>")
-        print("</ul>")
+            print(f"<li>{product_name}</li>", file=out)
+        print("</ul>", file=out)
     if dropped:
-        print("<h3>Products removed</h3>")
-        print("<ul>")
+        print("<h3>Products removed</h3>", file=out)
+        print("<ul>", file=out)
         for product_name in sorted(dropped):
-            print(f"<li>{product_name}</li>")
-        print("</ul>")
+            print(f"<li>{product_name}</li>", file=out)
+        print("</ul>", file=out)
     if tickets:
-        jira = JiraCache()
-        print("<h3>Tickets merged</h3>")
-        print("<ul>")
+        print("<h3>Tickets merged</h3>", file=out)
+        print("<ul>", file=out)
         for ticket_id, product_names in sorted(tickets.items(), key=lambda item: int(item[0][3:])):
             print(
                 f"<li><a href=https://jira.lsstcorp.org/browse/"
-                f"{ticket_id}>{ticket_id}</a>: {jira[ticket_id]} [{', '.join(sorted(product_names))}]</li>"
+                f"{ticket_id}>{ticket_id}</a>: {jira[ticket_id]} [{', '.join(sorted(product_names))}]</li>",
+                file=out,
             )
-        print("</ul>")
+        print("</ul>", file=out)
+
 
+def print_changelog(
+    changelog: Changelog,
+    product_names: Set[str],
+    jira: Optional[JiraCache] = None,
+    out: TextIO = sys.stdout,
+):
+    """Render the whole changelog as a single HTML page.
 
-def print_changelog(changelog: Changelog, product_names: Set[str]):
-    print("<html>")
-    print("<head><title>Rubin Science Pipelines Changelog</title></head>")
-    print("<body>")
-    print("<h1>Rubin Science Pipelines Changelog</h1>")
+    The page is rendered into memory and written to out in one go.
+    """
+    buffer = io.StringIO()
+    print("<html>", file=buffer)
+    print(f"<head><title>{TITLE}</title></head>", file=buffer)
+    print("<body>", file=buffer)
+    print(f"<h1>{TITLE}</h1>", file=buffer)
 
-    for tag, values in changelog.items():
-        print_tag(tag, **values)
+    with ExitStack() as stack:
+        if jira is None:
+            jira = stack.enter_context(JiraCache())
+        jira.prefetch(
+            ticket for entry in changelog.values() for ticket in entry.tickets
+        )
+        for tag, entry in changelog.items():
+            print_tag(tag, jira, entry, buffer)
 
     gen_date = datetime.utcnow().strftime("%Y-%m-%d %H:%M +00:00")
     print(
-        f"<p>Generated at {gen_date} by considering {', '.join(sorted(product_names))}.</p>"
+        f"<p>Generated at {gen_date} by considering {', '.join(sorted(product_names))}.</p>",
+        file=buffer,
+    )
+    print("</body>", file=buffer)
+    print("</html>", file=buffer)
+    out.write(buffer.getvalue())
+
+
+def shard_key(tag: EupsTag) -> str:
+    """Name of the shard to which tag belongs: the year for weeklies
+    (``w_2021_05`` → ``2021``), the major version for releases
+    (``v19_0_0`` → ``v19``), and otherwise the year of release.
+    """
+    match = re.match(r"w_(\d{4})_", tag.name) or re.match(r"(v\d+)", tag.name)
+    return match.group(1) if match else str(tag.date.year)
+
+
+def _tag_json(tag: EupsTag, jira: JiraCache, entry: ChangelogEntry) -> Dict[str, Any]:
+    return {
+        "name": tag.name,
+        "date": tag.date.strftime("%Y-%m-%d") if tag.name != "master" else None,
+        "added": sorted(entry.added),
+        "dropped": sorted(entry.dropped),
+        "tickets": {
+            ticket_id: {
+                "summary": jira[ticket_id],
+                "products": sorted(product_names),
+            }
+            for ticket_id, product_names in sorted(
+                entry.tickets.items(), key=lambda item: int(item[0][3:])
+            )
+        },
+    }
+
+
+def _html_page(heading: str, nav: List[str], body: str, footer: str = "") -> str:
+    return (
+        "<html>\n"
+        f"<head><title>{heading}</title></head>\n"
+        "<body>\n"
+        f"<h1>{heading}</h1>\n"
+        f"<p>{' | '.join(nav)}</p>\n"
+        f"{body}"
+        f"{footer}"
+        "</body>\n"
+        "</html>\n"
     )
-    print("</body>")
-    print("</html>")
+
+
+def write_changelog(
+    changelog: Changelog,
+    product_names: Set[str],
+    output_dir: str,
+    jira: Optional[JiraCache] = None,
+) -> List[str]:
+    """Write the changelog to output_dir as HTML and JSON shards.
+
+    Each shard (see shard_key) gets a page, ``<key>.html``, and a JSON feed,
+    ``<key>.json``. ``index.html`` shows the master pseudo-tag and the most
+    recent shard; ``index.json`` lists the shards. A file is only rewritten
+    if its content hash has changed since the last run. Returns the names of
+    the files written.
+    """
+    with ExitStack() as stack:
+        if jira is None:
+            jira = stack.enter_context(JiraCache())
+        jira.prefetch(
+            ticket for entry in changelog.values() for ticket in entry.tickets
+        )
+
+        shards: Dict[str, List[EupsTag]] = defaultdict(list)
+        master = None
+        for tag in changelog:
+            if tag.name == "master":
+                master = tag
+            else:
+                shards[shard_key(tag)].append(tag)
+        keys = sorted(shards, key=lambda key: max(tag.date for tag in shards[key]))
+        keys.reverse()  # Newest first.
+        nav = ['<a href="index.html">latest</a>'] + [
+            f'<a href="{key}.html">{key}</a>' for key in keys
+        ]
+
+        files: Dict[str, str] = {}
+        bodies: Dict[str, str] = {}
+        for key in keys:
+            buffer = io.StringIO()
+            for tag in shards[key]:
+                print_tag(tag, jira, changelog[tag], buffer)
+            bodies[key] = buffer.getvalue()
+            files[f"{key}.html"] = _html_page(f"{TITLE}: {key}", nav, bodies[key])
+            files[f"{key}.json"] = json.dumps(
+                [_tag_json(tag, jira, changelog[tag]) for tag in shards[key]],
+                indent=1,
+            )
+
+        buffer = io.StringIO()
+        if master is not None:
+            print_tag(master, jira, changelog[master], buffer)
+        if keys:
+            buffer.write(bodies[keys[0]])
+        gen_date = datetime.utcnow().strftime("%Y-%m-%d %H:%M +00:00")
+        footer = (
+            f"<p>Generated at {gen_date} by considering "
+            f"{', '.join(sorted(product_names))}.</p>\n"
+        )
+        files["index.html"] = _html_page(TITLE, nav, buffer.getvalue(), footer)
+        files["index.json"] = json.dumps(
+            {
+                "master": _tag_json(master, jira, changelog[master])
+                if master is not None
+                else None,
+                "shards": [f"{key}.json" for key in keys],
+                "products": sorted(product_names),
+            },
+            indent=1,
+        )
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, SHARD_MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+    written = []
+    for filename, content in files.items():
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        path = os.path.join(output_dir, filename)
+        if hashes.get(filename) == digest and os.path.exists(path):
+            continue
+        with open(path, "w") as f:
+            f.write(content)
+        hashes[filename] = digest
+        written.append(filename)
+    with open(manifest_path, "w") as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    return written
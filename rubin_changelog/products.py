@@ -1,22 +1,181 @@
 import logging
+import subprocess
+import threading
+import typing
 
-from .config import TARGET_DIR
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import DefaultDict, Dict, List, Optional, Tuple
+
+from .config import NETWORK_WORKERS, TARGET_DIR
+from .remote_heads import RemoteHeads
 from .repos_yaml import ReposYaml
 from .repository import Repository
 
 class Products(object):
     def __init__(self):
-        self._repos_yaml = ReposYaml()
-        self._products = {}
+        self._repos_yaml: Optional[ReposYaml] = None  # loaded on demand.
+        self._products: Dict[str, Repository] = {}
+        self._lock = threading.Lock()
+        self._product_locks: DefaultDict[str, threading.Lock] = defaultdict(
+            threading.Lock
+        )
+        self._failed: Dict[str, str] = {}  # product name → reason
+        self._remote_heads: Optional[RemoteHeads] = None  # loaded on demand.
+        # Clones, fetches, fetches skipped as unchanged, failures and resets.
+        self.fetch_counts: typing.Counter[str] = Counter()
 
-    def __getitem__(self, product_name: str) -> Repository:
-        if product_name not in self._products:
-            logging.debug(f"Materializing {product_name}")
-            self._products[product_name] = Repository.materialize(
-                self._repos_yaml[product_name]["url"],
-                TARGET_DIR,
-                branch_name=self._repos_yaml[product_name].get("ref", "master"),
+    @property
+    def repos_yaml(self) -> ReposYaml:
+        with self._lock:
+            if self._repos_yaml is None:
+                self._repos_yaml = ReposYaml()
+        return self._repos_yaml
+
+    @property
+    def remote_heads(self) -> RemoteHeads:
+        with self._lock:
+            if self._remote_heads is None:
+                self._remote_heads = RemoteHeads()
+        return self._remote_heads
+
+    def __count(self, event: str) -> None:
+        # Called from many worker threads at once.
+        with self._lock:
+            self.fetch_counts[event] += 1
+
+    def __record_state(self, product_name: str, repository: Repository) -> None:
+        if repository.fetched_state is not None:
+            self.remote_heads.put(
+                product_name,
+                self.repos_yaml[product_name]["url"],
+                repository.branch_name,
+                repository.fetched_state,
             )
+
+    def __getitem__(self, product_name: str) -> Repository:
+        with self._lock:
+            product_lock = self._product_locks[product_name]
+        # Only one thread materializes any given product; others wait for it.
+        with product_lock:
+            if product_name in self._failed:
+                raise KeyError(self._failed[product_name])
+            if product_name not in self._products:
+                logging.debug(f"Materializing {product_name}")
+                url = self.repos_yaml[product_name]["url"]
+                branch_name = self.repos_yaml[product_name].get("ref", "master")
+                repository = Repository.materialize(
+                    url,
+                    TARGET_DIR,
+                    branch_name=branch_name,
+                    known_state=self.remote_heads.get(product_name, url, branch_name),
+                    count=self.__count,
+                )
+                self.__record_state(product_name, repository)
+                self._products[product_name] = repository
         return self._products[product_name]
 
+    def has_failed(self, product_name: str) -> bool:
+        """True if product_name could not be cloned or fetched."""
+        return product_name in self._failed
+
+    def prepare(self, product_name: str) -> bool:
+        """Clone or fetch product_name, returning True on success.
+
+        Failures are logged and remembered: subsequent attempts to access the
+        product raise KeyError. Failure to load repos.yaml is not specific to
+        the product, so it is raised.
+        """
+        self.repos_yaml
+        try:
+            self[product_name]
+        except KeyError as e:
+            logging.warning(f"Repository for {product_name} not available: {e}")
+        except Exception as e:
+            logging.warning(f"Failed to materialize {product_name}: {e}")
+            self._failed[product_name] = f"Failed to materialize {product_name}: {e}"
+        else:
+            return True
+        return False
+
+    def reload(self, *, max_workers: int = NETWORK_WORKERS) -> List[str]:
+        """Reload repos.yaml, so that products added since are found, and
+        retry products which couldn't be cloned or fetched, returning the
+        names of those which now succeed. Repositories already materialized
+        are kept.
+        """
+        repos_yaml = ReposYaml()
+        with self._lock:
+            self._repos_yaml = repos_yaml
+            failed = sorted(self._failed)
+            self._failed.clear()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            prepared = executor.map(self.prepare, failed)
+            return [
+                product_name
+                for product_name, success in zip(failed, prepared)
+                if success
+            ]
+
+    def refresh(self, *, max_workers: int = NETWORK_WORKERS) -> List[str]:
+        """Fetch every repository materialized so far whose branch has moved
+        or whose tags have changed on origin, returning the names of those
+        products.
+        """
+
+        def refresh_product(item: Tuple[str, Repository]) -> Optional[str]:
+            product_name, repository = item
+            try:
+                remote_head, state = repository.remote_state()
+                if state == repository.fetched_state and remote_head == repository.head:
+                    return None
+                logging.info(f"Updating {product_name}")
+                repository.update()
+                repository.fetched_state = state
+                self.__count("fetched")
+                self.__record_state(product_name, repository)
+            except subprocess.CalledProcessError as e:
+                logging.warning(f"Failed to refresh {product_name}: {e.output}")
+                self.__count("fetch failures")
+                return None
+            return product_name
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            moved = executor.map(refresh_product, sorted(self._products.items()))
+            return [product_name for product_name in moved if product_name]
+
+    def save(self) -> None:
+        """Record the branch tips fetched, so the next run can skip fetching
+        repositories which haven't changed.
+        """
+        if self._remote_heads is not None:
+            self._remote_heads.save()
+
+    def log_fetch_counts(self) -> None:
+        counts = ", ".join(
+            f"{self.fetch_counts[key]} {key}"
+            for key in ("cloned", "fetched", "unchanged", "fetch failures", "resets")
+        )
+        logging.info(f"Repositories: {counts}")
+        if self.fetch_counts["fetch failures"]:
+            logging.warning(
+                f"{self.fetch_counts['fetch failures']} fetches failed, "
+                f"{self.fetch_counts['resets']} repositories were re-cloned"
+            )
+
+    def disk_usage(self) -> Dict[str, int]:
+        """Size on disk, in bytes, of each repository materialized so far."""
+        return {
+            product_name: repository.disk_usage()
+            for product_name, repository in sorted(self._products.items())
+        }
+
+    def log_disk_usage(self) -> None:
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return  # Not worth walking every repository.
+        usage = self.disk_usage()
+        for product_name, size in sorted(usage.items(), key=lambda item: -item[1]):
+            logging.info(f"{product_name}: {size / 2**20:.1f} MiB")
+        logging.info(f"Total repository storage: {sum(usage.values()) / 2**20:.1f} MiB")
+
 products = Products()
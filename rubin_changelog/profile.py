@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+import typing
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, DefaultDict, Dict, Iterator, Mapping
+
+from .scheduler import StageTiming
+
+
+class CallStats(object):
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+class Profile(object):
+    """Number and total duration of calls, and counts of events such as
+    cache hits, gathered across threads.
+
+    Calls are recorded against a key in each of one or more categories; e.g.
+    a git call against both its command and its repository.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._start = time.monotonic()
+            self._calls: DefaultDict[str, DefaultDict[str, CallStats]] = defaultdict(
+                lambda: defaultdict(CallStats)
+            )
+            self._counts: DefaultDict[str, typing.Counter[str]] = defaultdict(Counter)
+
+    def record(self, seconds: float, **keys: str) -> None:
+        """Record a call lasting seconds against category=key for each of
+        keys.
+        """
+        with self._lock:
+            for category, key in keys.items():
+                stats = self._calls[category][key]
+                stats.count += 1
+                stats.seconds += seconds
+
+    @contextmanager
+    def timed(self, **keys: str) -> Iterator[None]:
+        """Record the duration of the enclosed block (see record)."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(time.monotonic() - start, **keys)
+
+    def count(self, category: str, event: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[category][event] += n
+
+    def report(self, stages: Mapping[str, StageTiming] = {}) -> Dict[str, Any]:
+        """Everything recorded since the last reset, plus the given pipeline
+        stage timings. Calls are listed slowest first.
+        """
+        with self._lock:
+            report: Dict[str, Any] = {
+                "wall": time.monotonic() - self._start,
+                "stages": {
+                    stage: {"count": t.count, "wall": t.wall, "busy": t.busy}
+                    for stage, t in stages.items()
+                },
+                "counts": {
+                    category: dict(counts) for category, counts in self._counts.items()
+                },
+            }
+            for category, calls in sorted(self._calls.items()):
+                report[category] = {
+                    key: {"count": stats.count, "seconds": stats.seconds}
+                    for key, stats in sorted(
+                        calls.items(), key=lambda item: -item[1].seconds
+                    )
+                }
+        return report
+
+    def write(self, path: str, stages: Mapping[str, StageTiming] = {}) -> None:
+        with open(path, "w") as f:
+            json.dump(self.report(stages), f, indent=1)
+
+
+PROFILE = Profile()
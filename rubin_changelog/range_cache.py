@@ -0,0 +1,91 @@
+import dbm
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Iterable, Optional, Set
+
+from .config import RANGE_CACHE, RANGE_CACHE_MAX_AGE, RANGE_CACHE_VERSION
+from .profile import PROFILE
+
+VERSION_KEY = "__version__"
+
+
+class RangeCache(object):
+    """Tickets merged between two commits of a product, cached with dbm.
+
+    Entries are keyed by resolved SHAs rather than tag names, so they remain
+    valid if a tag is moved. Entries which have not been used within
+    ``max_age`` days are evicted when the cache is closed.
+    """
+
+    def __init__(
+        self,
+        *,
+        cache_location: str = RANGE_CACHE,
+        max_age: float = RANGE_CACHE_MAX_AGE,
+        version: str = RANGE_CACHE_VERSION,
+    ):
+        self.__max_age = max_age * 24 * 3600
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_location), exist_ok=True)
+        self.__db = dbm.open(cache_location, "c")  # type: ignore[attr-defined]
+        if self.__db.get(VERSION_KEY, b"").decode("utf-8") != version:
+            logging.info(f"Discarding range cache at {cache_location}")
+            self.__db.close()
+            self.__db = dbm.open(cache_location, "n")  # type: ignore[attr-defined]
+            self.__db[VERSION_KEY] = version.encode("utf-8")
+
+    @staticmethod
+    def __key(product_name: str, old_sha: str, new_sha: str) -> str:
+        return f"{product_name}:{old_sha}:{new_sha}"
+
+    def get(self, product_name: str, old_sha: str, new_sha: str) -> Optional[Set[str]]:
+        key = self.__key(product_name, old_sha, new_sha)
+        with self.__lock:
+            if key not in self.__db:
+                PROFILE.count("RangeCache", "misses")
+                return None
+            PROFILE.count("RangeCache", "hits")
+            entry = json.loads(self.__db[key])
+            entry["used"] = time.time()
+            self.__db[key] = json.dumps(entry).encode("utf-8")
+        return set(entry["tickets"])
+
+    def put(
+        self, product_name: str, old_sha: str, new_sha: str, tickets: Iterable[str]
+    ) -> None:
+        entry = {"tickets": sorted(tickets), "used": time.time()}
+        with self.__lock:
+            self.__db[self.__key(product_name, old_sha, new_sha)] = json.dumps(
+                entry
+            ).encode("utf-8")
+
+    def evict(self, max_age: Optional[float] = None) -> int:
+        """Remove entries not used within max_age seconds; return the number
+        removed.
+        """
+        cutoff = time.time() - (self.__max_age if max_age is None else max_age)
+        with self.__lock:
+            stale = [
+                key
+                for key in self.__db.keys()
+                if key != VERSION_KEY.encode("utf-8")
+                and json.loads(self.__db[key])["used"] < cutoff
+            ]
+            for key in stale:
+                del self.__db[key]
+        logging.debug(f"Evicted {len(stale)} range cache entries")
+        return len(stale)
+
+    def close(self) -> None:
+        self.evict()
+        self.__db.close()
+
+    def __enter__(self) -> "RangeCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,46 @@
+import json
+import logging
+import threading
+
+from typing import Dict, Optional
+
+from .config import REMOTE_HEADS
+from .utils import write_json_atomically
+
+
+class RemoteHeads(object):
+    """The state of each product's origin when it was last fetched: a digest
+    of its branch tip and tags (see Repository.remote_state).
+
+    Entries are only used if the URL and branch they were recorded against
+    are unchanged.
+    """
+
+    def __init__(self, path: str = REMOTE_HEADS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._heads: Dict[str, Dict[str, str]] = {}
+        try:
+            with open(self.path, "r") as f:
+                self._heads = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.info(f"No usable remote heads at {self.path}: {e}")
+
+    def get(self, product_name: str, url: str, branch_name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._heads.get(product_name)
+        if entry is None or (entry["url"], entry["branch"]) != (url, branch_name):
+            return None
+        return entry.get("state")
+
+    def put(self, product_name: str, url: str, branch_name: str, state: str) -> None:
+        with self._lock:
+            self._heads[product_name] = {
+                "url": url,
+                "branch": branch_name,
+                "state": state,
+            }
+
+    def save(self) -> None:
+        with self._lock:
+            write_json_atomically(self.path, self._heads, indent=1, sort_keys=True)
@@ -4,10 +4,11 @@ from typing import Dict
 from urllib.request import urlopen
 
 from rubin_changelog.config import REPOS_YAML
+from rubin_changelog.profile import PROFILE
 
 class ReposYaml(object):
     def __init__(self, *, repos_yaml: str = REPOS_YAML):
-        with urlopen(repos_yaml) as u:
+        with PROFILE.timed(http="ReposYaml"), urlopen(repos_yaml) as u:
             self.__yaml = yaml.safe_load(u)
 
     def __getitem__(self, product: str) -> Dict[str, str]:
@@ -1,34 +1,104 @@
+import bisect
+import hashlib
 import logging
 import os
 import re
 import shutil
 import subprocess
+import threading
 from datetime import datetime
 
-from typing import List, Set, Optional
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Set,
+    Optional,
+    Tuple,
+)
 
+from .commit_index import CommitIndex
+from .config import CLONE_FILTER, GIT_BACKEND
+from .git_backend import GitBackend, call_git, make_backend, stream_git
 
-def call_git(*args: str, cwd: str, git_exec: str = "/usr/bin/git") -> str:
-    to_exec = [git_exec] + list(args)
 
-    logging.debug(to_exec)
-    logging.debug(cwd)
-    return subprocess.check_output(to_exec, cwd=cwd, stderr=subprocess.STDOUT).decode(
-        "utf-8"
+class CommitRecord(NamedTuple):
+    sha: str
+    parents: Tuple[str, ...]
+    author_date: datetime
+    commit_date: datetime
+    subject: str
+
+    @property
+    def is_merge(self) -> bool:
+        return len(self.parents) > 1
+
+
+# Fields emitted by ``git log`` for each CommitRecord; fields and records are
+# both NUL-delimited (the latter by ``-z``), so we can split on NUL and regroup.
+_COMMIT_RECORD_FORMAT = "%H%x00%P%x00%at%x00%ct%x00%s"
+_COMMIT_RECORD_FIELDS = 5
+
+
+def _split_object(data: bytes) -> Tuple[List[str], str]:
+    """Split a raw commit or tag object into header lines and message."""
+    headers, _, message = data.decode("utf-8", errors="replace").partition("\n\n")
+    return headers.split("\n"), message
+
+
+def _subject(message: str) -> str:
+    """Return the subject of message, as ``git log --pretty=%s`` would."""
+    return " ".join(message.strip().split("\n\n")[0].split("\n"))
+
+
+def _remote_state(
+    remote: str, branch_name: str, *, cwd: str, repository: Optional[str] = None
+) -> Tuple[Optional[str], str]:
+    """See Repository.remote_state; remote may be a remote name or URL."""
+    branch_ref = f"refs/heads/{branch_name}"
+    lines = sorted(
+        call_git(
+            "ls-remote",
+            remote,
+            branch_ref,
+            "refs/tags/*",
+            cwd=cwd,
+            repository=repository,
+        ).splitlines()
+    )
+    head = next(
+        (line.split()[0] for line in lines if line.split()[1:] == [branch_ref]), None
     )
+    return head, hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
 
 
 class Repository(object):
-    def __init__(self, path: str, *, branch_name: str = "master"):
+    def __init__(
+        self, path: str, *, branch_name: str = "master", backend: str = GIT_BACKEND
+    ):
         self.path = path
         self.branch_name = branch_name
-        self._tags: Set[str] = set()  # populated on demand.
+        self._tags: Optional[Set[str]] = None  # loaded on demand.
+        self._backend: GitBackend = make_backend(backend, path)
+        self._lock = threading.Lock()  # guards loading of the below.
+        self._index_lock = threading.Lock()  # held while updating the index.
+        self._index: Optional[CommitIndex] = None  # loaded on demand.
+        # First-parent history of branch_name, as parallel lists sorted by
+        # commit time; loaded on demand.
+        self._timeline: Optional[Tuple[List[float], List[str]]] = None
+        # Digest of origin's refs as of the last fetch (see remote_state), if
+        # known.
+        self.fetched_state: Optional[str] = None
 
         # Make sure we're using the appropriate branch
         self.__call_git("symbolic-ref", "HEAD", f"refs/heads/{branch_name}")
 
-    def __call_git(self, *args: str) -> str:
-        return call_git(*args, cwd=self.path)
+    def __call_git(self, *args: str, input: Optional[str] = None) -> str:
+        return call_git(*args, cwd=self.path, input=input)
 
     def commits(
         self, reachable_from: Optional[str] = None, merges_only: bool = False
@@ -47,35 +117,246 @@ class Repository(object):
         except:
             return []
 
+    def commit_records(
+        self, *revisions: str, merges_only: bool = False, reverse: bool = False
+    ) -> Iterator[CommitRecord]:
+        """Stream hash, parents, dates and subject for every commit in
+        revisions using a single ``git log``.
+
+        If reverse is set, commits are returned in topological order, parents
+        first.
+        """
+        args = ["log", "-z", f"--pretty=format:{_COMMIT_RECORD_FORMAT}"]
+        if merges_only:
+            args.append("--merges")
+        if reverse:
+            args.extend(["--topo-order", "--reverse"])
+        args.extend(revisions)
+        fields: List[str] = []
+        for field in stream_git(*args, cwd=self.path):
+            fields.append(field)
+            if len(fields) == _COMMIT_RECORD_FIELDS:
+                sha, parents, author_time, commit_time, subject = fields
+                yield CommitRecord(
+                    sha,
+                    tuple(parents.split()),
+                    datetime.fromtimestamp(int(author_time)),
+                    datetime.fromtimestamp(int(commit_time)),
+                    subject,
+                )
+                fields = []
+
+    @property
+    def index(self) -> CommitIndex:
+        with self._lock:
+            if self._index is None:
+                self._index = CommitIndex(
+                    os.path.join(self.path, "changelog-index.json")
+                )
+        return self._index
+
+    def update_index(self, *wanted: str) -> int:
+        """Add any commits reachable from refs but not yet indexed to the
+        index, returning the number added.
+
+        Only one thread updates the index at a time. If wanted SHAs are
+        given, nothing is done if they have all been indexed by the time it
+        is this thread's turn.
+        """
+        with self._index_lock:
+            if wanted and all(sha in self.index for sha in wanted):
+                return 0
+            exclude = [f"^{sha}" for sha in self.index.tips()]
+            added = self.index.add(
+                (
+                    record.sha,
+                    record.parents,
+                    self.ticket(record.subject) if record.is_merge else None,
+                )
+                for record in self.commit_records("--all", *exclude, reverse=True)
+            )
+            if added:
+                logging.debug(f"Indexed {added} commits in {self.path}")
+                self.index.save()
+        return added
+
+    def merge_tickets(self, old: str, new: str) -> Set[str]:
+        """Tickets named by merges in ``old...new``, where old and new are
+        commit SHAs.
+        """
+        if old not in self.index or new not in self.index:
+            self.update_index(old, new)
+        try:
+            return self.index.merge_tickets_between(old, new)
+        except KeyError:
+            logging.warning(f"Commit index incomplete in {self.path}; using git log")
+        tickets = set()
+        for record in self.commit_records(f"{old}...{new}", merges_only=True):
+            ticket = self.ticket(record.subject)
+            if ticket:
+                tickets.add(ticket)
+        return tickets
+
+    def resolve(self, *refs: str) -> List[str]:
+        """Return the commit SHA for each of refs, raising KeyError if any of
+        them doesn't name a commit.
+        """
+        resolved = self.resolve_commits(refs)
+        for ref in refs:
+            if resolved[ref] is None:
+                raise KeyError(f"{ref} is not a commit in {self.path}")
+        return [resolved[ref] for ref in refs]  # type: ignore[misc]
+
+    def resolve_commits(self, refs: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Map each of refs to the commit it names, or None if it doesn't
+        name a commit.
+        """
+        refs = list(refs)
+        objects = self._backend.read_objects([f"{ref}^{{commit}}" for ref in refs])
+        return {
+            ref: obj.sha if obj is not None and obj.type == "commit" else None
+            for ref, obj in zip(refs, objects)
+        }
+
     def message(self, commit_hash: str) -> str:
-        return self.__call_git("show", commit_hash, "--pretty=format:%s")
+        obj = self._backend.read_objects([f"{commit_hash}^{{commit}}"])[0]
+        if obj is None:
+            raise KeyError(f"{commit_hash} is not a commit in {self.path}")
+        return _subject(_split_object(obj.data)[1])
 
     def tag_date(self, tag_name: str) -> datetime:
-        return datetime.fromtimestamp(
-            int(self.__call_git("tag", "-l", tag_name, "--format=%(taggerdate:unix)"))
-        )
+        obj = self._backend.read_objects([f"refs/tags/{tag_name}"])[0]
+        if obj is None or obj.type != "tag":
+            raise KeyError(f"{tag_name} is not an annotated tag in {self.path}")
+        for header in _split_object(obj.data)[0]:
+            if header.startswith("tagger "):
+                return datetime.fromtimestamp(int(header.split()[-2]))
+        raise ValueError(f"{tag_name} has no tagger in {self.path}")
+
+    def sha_for_date(self, date: datetime) -> str:
+        return self.shas_for_dates([date])[0]
 
-    def sha_for_date(self, date: datetime):
-        return self.__call_git(
-            "rev-list", "-1", f'--before="{date}"', self.branch_name
-        ).strip()
+    def shas_for_dates(self, dates: Iterable[datetime]) -> List[str]:
+        """For each of dates, return the last commit on the first-parent
+        history of the branch made at or before that date, or an empty string
+        if there is none.
+        """
+        with self._lock:
+            if self._timeline is None:
+                records = sorted(
+                    (record.commit_date.timestamp(), record.sha)
+                    for record in self.commit_records(
+                        "--first-parent", self.branch_name
+                    )
+                )
+                self._timeline = [r[0] for r in records], [r[1] for r in records]
+            times, shas = self._timeline
+        result = []
+        for date in dates:
+            position = bisect.bisect_right(times, date.timestamp())
+            result.append(shas[position - 1] if position else "")
+        return result
 
     @property
     def tags(self) -> Set[str]:
-        if not self._tags:
+        if self._tags is None:
             self._tags = set(tag for tag in self.__call_git("tag").split())
         return self._tags
 
     def add_tag(self, tag_name: str, target: str) -> None:
-        if tag_name in self.tags:
-            self.__call_git("tag", "-d", tag_name)
-        self.__call_git("tag", tag_name, target)
-        self._tags.add(tag_name)
+        self.add_tags({tag_name: target})
+
+    def add_tags(self, targets: Mapping[str, str]) -> None:
+        """Create or move a tag for each tag name → target in targets, in a
+        single transaction.
+        """
+        if not targets:
+            return
+        self.__call_git(
+            "update-ref",
+            "--stdin",
+            input="".join(
+                f"update refs/tags/{tag_name} {target}\n"
+                for tag_name, target in targets.items()
+            ),
+        )
+        self._backend.reset()
+        self.tags.update(targets)
 
     def update(self) -> str:
-        return self.__call_git(
+        output = self.__call_git(
             "fetch", "origin", f"{self.branch_name}:{self.branch_name}"
         )
+        self._backend.reset()
+        self._tags = None
+        self._timeline = None
+        self.update_index()
+        return output
+
+    def close(self) -> None:
+        self._backend.close()
+
+    @property
+    def head(self) -> str:
+        """The commit at the tip of the local branch."""
+        return self.resolve(f"refs/heads/{self.branch_name}")[0]
+
+    def remote_state(self) -> Tuple[Optional[str], str]:
+        """The commit at the tip of the branch on origin, and a digest of
+        that and all of origin's tags, without fetching.
+
+        A fetch is needed if the digest has changed since the last one, even
+        if the branch hasn't moved, to pick up tags on existing commits.
+        """
+        return _remote_state("origin", self.branch_name, cwd=self.path)
+
+    @property
+    def is_partial(self) -> bool:
+        """True if this is a partial clone, missing some objects."""
+        try:
+            promisor = self.__call_git("config", "--get", "remote.origin.promisor")
+        except subprocess.CalledProcessError:
+            return False
+        return promisor.strip() == "true"
+
+    def disk_usage(self) -> int:
+        """Total size, in bytes, of the repository on disk."""
+        return sum(
+            os.path.getsize(os.path.join(dirpath, filename))
+            for dirpath, _, filenames in os.walk(self.path)
+            for filename in filenames
+        )
+
+    @staticmethod
+    def convert_to_partial(path: str, url: str, clone_filter: str) -> None:
+        """Replace the full clone at path with a partial clone, filtered by
+        clone_filter, preserving all refs.
+
+        The new clone is made from the old one, so nothing is downloaded;
+        objects omitted by the filter will be fetched from url if ever needed.
+        """
+        partial_path = f"{path}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        call_git("config", "uploadpack.allowFilter", "true", cwd=path)
+        call_git(
+            "clone",
+            "--bare",
+            "--no-local",
+            f"--filter={clone_filter}",
+            f"file://{os.path.abspath(path)}",
+            partial_path,
+            cwd=os.path.dirname(path) or ".",
+            repository=path,
+        )
+        call_git("remote", "set-url", "origin", url, cwd=partial_path)
+        for filename in os.listdir(path):
+            # Carry over anything we store alongside git's own data.
+            if filename.startswith("changelog-"):
+                shutil.copy2(os.path.join(path, filename), partial_path)
+        old_path = f"{path}.old"
+        os.rename(path, old_path)
+        os.rename(partial_path, path)
+        shutil.rmtree(old_path)
 
     @staticmethod
     def ticket(message: str) -> Optional[str]:
@@ -88,10 +369,21 @@ class Repository(object):
 
     @classmethod
     def materialize(
-        cls, url: str, target_dir: str, *, branch_name: str = "master"
+        cls,
+        url: str,
+        target_dir: str,
+        *,
+        branch_name: str = "master",
+        clone_filter: Optional[str] = CLONE_FILTER,
+        known_state: Optional[str] = None,
+        count: Callable[[str], None] = lambda event: None,
     ) -> "Repository":
         # Try to re-use an on disk repository. However, if it's corrupted,
-        # blow it away and clone a fresh copy.
+        # blow it away and clone a fresh copy. If clone_filter is set, make
+        # partial clones, converting any existing full clone. If known_state
+        # is the current digest of origin's refs (see remote_state) and the
+        # local branch matches origin, there's nothing to fetch. What was
+        # done is reported to count.
         repo_dir_name = re.sub(r".git$", "", url.split("/")[-1])
         clone_path = os.path.join(target_dir, repo_dir_name)
         os.makedirs(target_dir, exist_ok=True)
@@ -100,25 +392,53 @@ class Repository(object):
             """Clone repo at url into a subdirectory target_dir, clobbering
             pre-existing content, returning the resulting path.
             """
-            call_git(
-                "clone",
-                "--bare",
-                "--branch",
-                branch_name,
-                url,
-                repo_dir_name,
-                cwd=target_dir,
-            )
+            args = ["clone", "--bare", "--branch", branch_name]
+            if clone_filter:
+                args.append(f"--filter={clone_filter}")
+            call_git(*args, url, repo_dir_name, cwd=target_dir, repository=clone_path)
+
+        def remove_leftovers() -> None:
+            """Remove anything left behind by an interrupted conversion."""
+            for leftover in (f"{clone_path}.partial", f"{clone_path}.old"):
+                shutil.rmtree(leftover, ignore_errors=True)
 
+        remove_leftovers()
         if not os.path.exists(clone_path):
+            # A fresh clone is already up to date. Origin's state is taken
+            # first, so that anything pushed meanwhile is fetched next time.
+            _, state = _remote_state(
+                url, branch_name, cwd=target_dir, repository=clone_path
+            )
             clone()
-        repo = cls(clone_path, branch_name=branch_name)
+            count("cloned")
+            fresh = cls(clone_path, branch_name=branch_name)
+            fresh.fetched_state = state
+            return fresh
+        repo: Optional[Repository] = None
         try:
-            repo.update()
-        except subprocess.CalledProcessError as e:
-            logging.warn(f"Unable to update {clone_path}: {e}; {e.output}; resetting")
-            shutil.rmtree(clone_path)
+            repo = cls(clone_path, branch_name=branch_name)
+            if clone_filter and not repo.is_partial:
+                logging.info(f"Converting {clone_path} to a partial clone")
+                repo.close()
+                cls.convert_to_partial(clone_path, url, clone_filter)
+                repo = cls(clone_path, branch_name=branch_name)
+            remote_head, state = repo.remote_state()
+            if state == known_state and remote_head == repo.head:
+                logging.debug(f"{clone_path} is up to date")
+                count("unchanged")
+            else:
+                repo.update()
+                count("fetched")
+            repo.fetched_state = state
+        except (subprocess.CalledProcessError, KeyError, OSError) as e:
+            output = getattr(e, "output", "")
+            logging.warn(f"Unable to update {clone_path}: {e}; {output}; resetting")
+            count("fetch failures")
+            if repo is not None:
+                repo.close()
+            shutil.rmtree(clone_path, ignore_errors=True)
+            remove_leftovers()
             clone()
+            count("resets")
             repo = cls(clone_path, branch_name=branch_name)
-            repo.update()
         return repo
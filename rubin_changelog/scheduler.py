@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Mapping
+
+from .config import GIT_WORKERS, NETWORK_WORKERS
+
+DEFAULT_WORKERS = {"network": NETWORK_WORKERS, "git": GIT_WORKERS}
+
+
+class StageTiming(object):
+    def __init__(self):
+        self.count = 0
+        self.busy = 0.0  # Summed duration of all tasks.
+        self.start = float("inf")
+        self.end = float("-inf")
+
+    @property
+    def wall(self) -> float:
+        return max(self.end - self.start, 0.0)
+
+
+class Task(Future):
+    """A future which records whether its outcome has been examined."""
+
+    def __init__(self, stage: str):
+        super().__init__()
+        self.stage = stage
+        self.consumed = False
+
+    def result(self, timeout=None):
+        self.consumed = True
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        self.consumed = True
+        return super().exception(timeout)
+
+
+class Scheduler(object):
+    """Run tasks as soon as the tasks they depend on have completed.
+
+    Each task is executed in the pool belonging to the resource it uses
+    (e.g. "network" or "git"), which bounds how many such tasks run at once.
+    If a dependency fails, the dependent task is not run; its future fails
+    with the same exception. Failures which nothing examined are logged on
+    shutdown.
+    """
+
+    def __init__(self, workers: Mapping[str, int] = DEFAULT_WORKERS):
+        self._pools = {
+            resource: ThreadPoolExecutor(
+                max_workers=count, thread_name_prefix=resource
+            )
+            for resource, count in workers.items()
+        }
+        self._lock = threading.Lock()
+        self._outstanding: List[Task] = []
+        self._timings: Dict[str, StageTiming] = defaultdict(StageTiming)
+
+    def __timed(self, stage: str, fn: Callable, *args, **kwargs) -> Any:
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                timing = self._timings[stage]
+                timing.count += 1
+                timing.busy += end - start
+                timing.start = min(timing.start, start)
+                timing.end = max(timing.end, end)
+
+    def submit(
+        self,
+        resource: str,
+        fn: Callable,
+        *args,
+        after: Iterable[Future] = (),
+        stage: str = "",
+        **kwargs,
+    ) -> Future:
+        """Run fn(*args, **kwargs) using resource once all of after are done.
+
+        stage names the pipeline stage for timing purposes; it defaults to
+        the name of fn.
+        """
+        pool = self._pools[resource]
+        stage = stage or fn.__name__
+        result = Task(stage)
+        dependencies = set(after)
+        with self._lock:
+            self._outstanding.append(result)
+
+        # Remaining dependencies; set to None once the task has been launched
+        # or failed, so that only one callback acts.
+        state_lock = threading.Lock()
+        state: List[Any] = [len(dependencies)]
+
+        def chain(inner: Future) -> None:
+            if inner.exception() is not None:
+                result.set_exception(inner.exception())
+            else:
+                result.set_result(inner.result())
+
+        def launch() -> None:
+            if result.set_running_or_notify_cancel():
+                pool.submit(self.__timed, stage, fn, *args, **kwargs).add_done_callback(
+                    chain
+                )
+
+        def dependency_done(dependency: Future) -> None:
+            failed = dependency.cancelled() or dependency.exception() is not None
+            with state_lock:
+                if state[0] is None:
+                    return
+                state[0] = None if failed else state[0] - 1
+                ready = state[0] == 0
+                if ready:
+                    state[0] = None
+            if failed and not result.cancelled():
+                result.set_exception(
+                    CancelledError()
+                    if dependency.cancelled()
+                    else dependency.exception()  # type: ignore[arg-type]
+                )
+            elif ready:
+                launch()
+
+        if not dependencies:
+            launch()
+        for dependency in dependencies:
+            dependency.add_done_callback(dependency_done)
+        return result
+
+    def timings(self) -> Dict[str, StageTiming]:
+        with self._lock:
+            return dict(self._timings)
+
+    def log_timings(self) -> None:
+        for stage, timing in self.timings().items():
+            logging.info(
+                f"Stage {stage}: {timing.count} tasks, {timing.wall:.1f}s wall, "
+                f"{timing.busy:.1f}s busy"
+            )
+
+    def shutdown(self) -> None:
+        """Wait for every submitted task, including those still waiting on
+        dependencies, then stop the worker pools.
+        """
+        while True:
+            with self._lock:
+                outstanding = [f for f in self._outstanding if not f.done()]
+            if not outstanding:
+                break
+            wait(outstanding)
+        for pool in self._pools.values():
+            pool.shutdown()
+        with self._lock:
+            unexamined = [f for f in self._outstanding if not f.consumed]
+            self._outstanding = []
+        for task in unexamined:
+            if not task.cancelled() and task.exception() is not None:
+                logging.error(
+                    f"Stage {task.stage} task failed with nothing waiting for it",
+                    exc_info=task.exception(),
+                )
+        self.log_timings()
+
+    def __enter__(self) -> "Scheduler":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, NamedTuple, Tuple
+
+from .config import TICKET_INDEX
+from .typing import Changelog
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT PRIMARY KEY,
+    date TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shipped (
+    ticket TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    product TEXT NOT NULL,
+    PRIMARY KEY (ticket, tag, product)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS shipped_by_product ON shipped (product, ticket);
+"""
+
+
+class Release(NamedTuple):
+    tag: str
+    date: str  # YYYY-MM-DD
+    products: List[str]
+
+
+class TicketIndex(object):
+    """The tags in which each ticket was shipped, and the products it
+    touched in each, kept in SQLite so that they can be queried without git
+    or the network.
+
+    Each tag's entry is replaced whenever a changelog including it is
+    recorded; the master pseudo-tag is never recorded, since it moves.
+    """
+
+    def __init__(self, path: str = TICKET_INDEX, *, readonly: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        if readonly:
+            # Raises sqlite3.OperationalError if there is no index.
+            self._db = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+
+    def update(self, changelog: Changelog) -> None:
+        """Record the tickets shipped in every tag in changelog."""
+        tags = [tag for tag in changelog if tag.name != "master"]
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM shipped WHERE tag = ?", [(tag.name,) for tag in tags]
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tags (tag, date) VALUES (?, ?)",
+                [(tag.name, tag.date.strftime("%Y-%m-%d %H:%M:%S")) for tag in tags],
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO shipped (ticket, tag, product) VALUES (?, ?, ?)",
+                [
+                    (ticket.upper(), tag.name, product_name)
+                    for tag in tags
+                    for ticket, product_names in changelog[tag].tickets.items()
+                    for product_name in product_names
+                ],
+            )
+
+    @staticmethod
+    def __group(rows: List[Tuple[str, str, str, str]]) -> Dict[str, List[Release]]:
+        """Group (ticket, tag, date, product) rows, ordered by ticket and
+        date, into the releases of each ticket.
+        """
+        releases: DefaultDict[str, List[Release]] = defaultdict(list)
+        for ticket, tag, date, product_name in rows:
+            if not releases[ticket] or releases[ticket][-1].tag != tag:
+                releases[ticket].append(Release(tag, date[:10], []))
+            releases[ticket][-1].products.append(product_name)
+        return dict(releases)
+
+    def ticket(self, ticket: str) -> List[Release]:
+        """Every tag which shipped ticket, earliest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ticket, tag, date, product FROM shipped JOIN tags USING (tag) "
+                "WHERE ticket = ? ORDER BY date, tag, product",
+                (ticket.upper(),),
+            ).fetchall()
+        return self.__group(rows).get(ticket.upper(), [])
+
+    def product(self, product_name: str) -> Dict[str, List[Release]]:
+        """Every tag which shipped each ticket merged to product_name,
+        earliest first. Only product_name is listed in each release.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ticket, tag, date, product FROM shipped JOIN tags USING (tag) "
+                "WHERE product = ? ORDER BY ticket, date, tag",
+                (product_name,),
+            ).fetchall()
+        return self.__group(rows)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "TicketIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,9 +1,75 @@
-from typing import MutableMapping, Mapping, Union, Set
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Mapping, MutableMapping, Set
 
 from .eups import EupsTag
+from .ids import PRODUCTS, TICKETS
 
-# Should be a dataclass or something...
-Changelog = MutableMapping[
-    EupsTag, Mapping[str, Union[Set[str], Mapping[str, Set[str]]]]
-]
 
+@dataclass
+class ChangelogEntry:
+    """Changes between a tag and its predecessor.
+
+    Products and tickets are stored by interned ID, with sets of products as
+    bitsets; the properties present them by name. failed_bits holds the
+    products whose merged tickets couldn't be determined.
+    """
+
+    added_bits: int = 0
+    dropped_bits: int = 0
+    ticket_bits: Dict[int, int] = field(default_factory=dict)  # ticket → products
+    failed_bits: int = 0
+
+    def add_tickets(self, product_name: str, tickets: Iterable[str]) -> None:
+        product_bit = 1 << PRODUCTS.id(product_name)
+        for ticket in tickets:
+            ticket_id = TICKETS.id(ticket)
+            self.ticket_bits[ticket_id] = (
+                self.ticket_bits.get(ticket_id, 0) | product_bit
+            )
+
+    def add_failure(self, product_name: str) -> None:
+        self.failed_bits |= 1 << PRODUCTS.id(product_name)
+
+    @property
+    def complete(self) -> bool:
+        return not self.failed_bits
+
+    @property
+    def added(self) -> Set[str]:
+        return set(PRODUCTS.names(self.added_bits))
+
+    @property
+    def dropped(self) -> Set[str]:
+        return set(PRODUCTS.names(self.dropped_bits))
+
+    @property
+    def tickets(self) -> Dict[str, Set[str]]:
+        return {
+            TICKETS.name(ticket_id): set(PRODUCTS.names(product_bits))
+            for ticket_id, product_bits in self.ticket_bits.items()
+        }
+
+    @property
+    def failed(self) -> Set[str]:
+        return set(PRODUCTS.names(self.failed_bits))
+
+    @classmethod
+    def from_names(
+        cls,
+        added: Iterable[str],
+        dropped: Iterable[str],
+        tickets: Mapping[str, Iterable[str]],
+        failed: Iterable[str] = (),
+    ) -> "ChangelogEntry":
+        return cls(
+            PRODUCTS.bits(added),
+            PRODUCTS.bits(dropped),
+            {
+                TICKETS.id(ticket): PRODUCTS.bits(product_names)
+                for ticket, product_names in tickets.items()
+            },
+            PRODUCTS.bits(failed),
+        )
+
+
+Changelog = MutableMapping[EupsTag, ChangelogEntry]
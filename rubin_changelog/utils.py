@@ -1,5 +1,9 @@
+import json
+import os
+import re
+
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional, Tuple
 from .config import RELEASE_DATES
 
 def tag_key(tagname: str) -> int:
@@ -30,3 +34,44 @@ def git_ref_from_eups_version(version: str) -> str:
     looks like a Git ref.
     """
     return version.split("+")[0]
+
+def tag_sort_key(tagname: str) -> Tuple[Tuple[int, ...], int, int]:
+    """Key for sorting tags by name alone, in order of release.
+
+    Numeric components are compared as integers, and release candidates sort
+    before the corresponding release:
+
+    "w_2020_9"    -> ((2020, 9), 1, 0)
+    "v19_0_0_rc1" -> ((19, 0, 0), 0, 1)
+    "v19_0_0"     -> ((19, 0, 0), 1, 0)
+    """
+    base, _, candidate = tagname.partition("_rc")
+    version = tuple(int(n) for n in re.findall(r"\d+", base))
+    if candidate:
+        return version, 0, int(candidate) if candidate.isdigit() else 0
+    return version, 1, 0
+
+def estimate_tag_date(tagname: str) -> Optional[datetime]:
+    """Estimate the release date of a tag from its name alone, without
+    consulting the distribution server.
+    """
+    date = infer_release_date(tagname)
+    if date is None and re.match(r"w_\d{4}_\d+$", tagname):
+        date = datetime.strptime(tagname + "_1", "w_%G_%V_%u")
+    return date
+
+def write_text_atomically(path: str, content: str) -> None:
+    """Write content to path, so that readers never see a partially written
+    file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def write_json_atomically(path: str, content: Any, **kwargs: Any) -> None:
+    """Write content to path as JSON, as write_text_atomically. kwargs are
+    passed to json.dumps.
+    """
+    write_text_atomically(path, json.dumps(content, **kwargs))